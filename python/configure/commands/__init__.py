@@ -1,19 +1,73 @@
 
-from pathlib import Path
-import pkgutil
 from importlib import import_module
-import inspect
 
 from .cmd import BaseCmd
 
-all_commands = []
-command_map = {}
+# Command class name -> "module:Class". Modules are only imported when a command is looked up.
+# New commands must be registered here.
+_REGISTRY: dict[str, str] = {
+    "AptInstallCmd": "apt_install:AptInstallCmd",
+    "ConfigureDisksCmd": "configure_disks:ConfigureDisksCmd",
+    "ConfigureDockerCmd": "configure_docker:ConfigureDockerCmd",
+    "ConfigureGpuPowerCmd": "configure_gpu_power:ConfigureGpuPowerCmd",
+    "CreateGpuPowerUdevRuleCmd": "configure_gpu_power:CreateGpuPowerUdevRuleCmd",
+    "CreateVfioPciPowerConfCmd": "configure_gpu_power:CreateVfioPciPowerConfCmd",
+    "VerifyGpuPowerStateCmd": "configure_gpu_power:VerifyGpuPowerStateCmd",
+    "AddGrubVirtualizationOptionsCmd": "configure_grub:AddGrubVirtualizationOptionsCmd",
+    "CreateGrubOverrideCmd": "configure_grub:CreateGrubOverrideCmd",
+    "GetGpuPciIdsCmd": "configure_grub:GetGpuPciIdsCmd",
+    "GetIommuTypeCmd": "configure_grub:GetIommuTypeCmd",
+    "ReadGrubCmd": "configure_grub:ReadGrubCmd",
+    "RemoveGrubOverrideCmd": "configure_grub:RemoveGrubOverrideCmd",
+    "UpdateInitramfsModulesCmd": "configure_initramfs:UpdateInitramfsModulesCmd",
+    "CheckVirtualizationCmd": "configure_libvirt:CheckVirtualizationCmd",
+    "ConfigureLibvirtCmd": "configure_libvirt:ConfigureLibvirtCmd",
+    "ConfigureMemoryCmd": "configure_memory:ConfigureMemoryCmd",
+    "CreateNvidiaNoDrmConfCmd": "configure_modprobe:CreateNvidiaNoDrmConfCmd",
+    "CreateVfioConfCmd": "configure_modprobe:CreateVfioConfCmd",
+    "InstallNvidiaContainerToolkitCmd": "nvidia:InstallNvidiaContainerToolkitCmd",
+    "InstallNvidiaCudaToolkitCmd": "nvidia:InstallNvidiaCudaToolkitCmd",
+    "InstallNvidiaDriverCmd": "nvidia:InstallNvidiaDriverCmd",
+    "RemoveNvidiaDriverCmd": "nvidia:RemoveNvidiaDriverCmd",
+    "RemoveCrontabCmd": "remove_crontab:RemoveCrontabCmd",
+}
+
+_instances: dict[str, BaseCmd] = {}
 
 def get_all_commands():
-    return all_commands
+    """Yields an instance of every registered command, importing modules as needed."""
+    for name in _REGISTRY:
+        command = get_command(name)
+        if command:
+            yield command
+
+def has_command(name: str) -> bool:
+    """Checks whether a command is registered without importing its module."""
+    return name in _REGISTRY
 
 def get_command(name: str) -> BaseCmd | None:
-    return command_map.get(name)
+    if name in _instances:
+        return _instances[name]
+    if name not in _REGISTRY:
+        return None
+
+    module_name, class_name = _REGISTRY[name].split(":")
+    try:
+        imported_module = import_module('.' + module_name, package=__name__)
+    except ImportError as e:
+        print("Could not import module " + module_name + ": " + str(e))
+        return None
+
+    instance = create_command_instance(getattr(imported_module, class_name))
+    if instance:
+        _instances[name] = instance
+    else:
+        print(f"Skipped {class_name}: could not create instance")
+    return instance
+
+def rebuild_registry():
+    """Drops all cached command instances so the next lookup creates fresh ones."""
+    _instances.clear()
 
 def create_command_instance(command_class):
     """Create an instance of a command class, handling special cases."""
@@ -25,25 +79,3 @@ def create_command_instance(command_class):
     except Exception as e:
         print(f"Error creating instance of {command_class.__name__}: {e}")
         return None
-
-for (_, name, _) in pkgutil.iter_modules([str(Path(__file__).parent)]):
-    try:
-        imported_module = import_module('.' + name, package=__name__)
-    except ImportError as e:
-        print("Could not import module " + name + ": " + str(e))
-        continue
-
-    for i in dir(imported_module):
-        attribute = getattr(imported_module, i)
-        if inspect.isclass(attribute) and (not inspect.isabstract(attribute)) and issubclass(attribute, BaseCmd) and attribute.__name__ != "BaseCmd":
-            print("Found command class: ", attribute.__name__)
-            
-            # Create instance instead of adding class
-            instance = create_command_instance(attribute)
-            if instance:
-                all_commands.append(instance)
-                #print(f"Added instance: {instance.name()}")
-            else:
-                print(f"Skipped {attribute.__name__}: could not create instance")
-
-command_map = {cmd.__class__.__name__: cmd for cmd in all_commands}
\ No newline at end of file
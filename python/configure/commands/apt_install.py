@@ -3,7 +3,9 @@
 import subprocess
 from typing import Any, Dict, List
 from .cmd import BaseCmd
-from .utils import run
+from .utils import apt_install
+
+__all__ = ["AptInstallCmd"]
 
 class AptInstallCmd(BaseCmd):
     """ Command to install packages using apt. """
@@ -17,10 +19,8 @@ class AptInstallCmd(BaseCmd):
     def execute(self, env: Dict[str, Any]) -> bool:
         packages = env.get("packages", [])
         try:
-            run(["apt-get", "update"])
             if len(packages) > 0:
-                print(f"Installing packages: {packages}")
-                run(["apt-get", "install", "-y"] + packages)
+                apt_install(packages)
             return True
         except subprocess.CalledProcessError as e:
             print(f"Failed to install packages {packages}: {e}")
@@ -1,32 +1,59 @@
 import os
 import subprocess
-import re
 import sys
 
-def check_vfio_driver():
+from .utils import PCI_DEVICES_DIR, nvidia_pci_devices
+
+NVIDIA_MARKER = 'nvidia corporation'  # Matched against the lowercased line
+VFIO_MARKER = 'Kernel driver in use: vfio-pci'
+
+# Number of lines after an NVIDIA device line that may hold its driver line
+DRIVER_LOOKAHEAD = 2
+
+def get_pci_driver(pci_addr):
     """
-    Checks if the VFIO driver is in use for NVIDIA GPUs after reboot.
+    Returns the name of the kernel driver bound to a PCI device, or None if unbound.
     """
-    print("\nChecking for VFIO driver in use...")
+    try:
+        return os.path.basename(os.readlink(os.path.join(PCI_DEVICES_DIR, pci_addr, 'driver')))
+    except FileNotFoundError:
+        return None
+
+def check_vfio_driver_lspci(first_only=False) -> bool:
+    """
+    Checks the VFIO driver binding by parsing 'lspci -k' output.
+    Returns True if at least one NVIDIA device uses vfio-pci.
+    """
+    vfio_found = False
     try:
         lspci_output = subprocess.check_output(['lspci', '-k']).decode('utf-8')
-        nvidia_pattern = r'NVIDIA Corporation.*'
-        vfio_pattern = r'Kernel driver in use: vfio-pci'
 
-        lines = lspci_output.splitlines()
         found_nvidia = False
-        for i, line in enumerate(lines):
-            if re.search(nvidia_pattern, line, re.IGNORECASE):
+        pending_nvidia = 0  # Lines left to scan for the driver of the last NVIDIA device
+        for line in lspci_output.splitlines():
+            if pending_nvidia:
+                if VFIO_MARKER in line:
+                    print("--> Kernel driver in use: vfio-pci (SUCCESS)")
+                    if first_only:
+                        return True
+                    vfio_found = True
+                    pending_nvidia = 0
+                    continue
+                pending_nvidia -= 1
+                if not pending_nvidia:
+                    print("--> VFIO driver NOT in use. Check your GRUB configuration.")
+
+            # Device lines start at column 0, their indented detail lines (such as
+            # "Subsystem: NVIDIA Corporation ...") belong to the device above
+            if not line[:1].isspace() and NVIDIA_MARKER in line.lower():
+                if pending_nvidia:
+                    print("--> VFIO driver NOT in use. Check your GRUB configuration.")
                 found_nvidia = True
                 print(f"Found NVIDIA device: {line.strip()}")
+                pending_nvidia = DRIVER_LOOKAHEAD
 
-                # Check the next few lines for the driver
-                if i + 1 < len(lines) and re.search(vfio_pattern, lines[i + 1], re.IGNORECASE):
-                    print("--> Kernel driver in use: vfio-pci (SUCCESS)")
-                elif i + 2 < len(lines) and re.search(vfio_pattern, lines[i + 2], re.IGNORECASE):
-                    print("--> Kernel driver in use: vfio-pci (SUCCESS)")
-                else:
-                    print("--> VFIO driver NOT in use. Check your GRUB configuration.")
+        if pending_nvidia:
+            print("--> VFIO driver NOT in use. Check your GRUB configuration.")
 
         if not found_nvidia:
             print("No NVIDIA devices found to check.")
@@ -34,3 +61,34 @@ def check_vfio_driver():
     except subprocess.CalledProcessError as e:
         print(f"Error running lspci: {e}")
 
+    return vfio_found
+
+def check_vfio_driver(*, first_only: bool = False) -> bool:
+    """
+    Checks if the VFIO driver is in use for NVIDIA GPUs after reboot.
+    With first_only=True, stops at the first NVIDIA device bound to vfio-pci.
+    Returns True if at least one NVIDIA device uses vfio-pci.
+    """
+    print("\nChecking for VFIO driver in use...")
+    try:
+        nvidia_devices = nvidia_pci_devices()
+    except OSError:
+        # sysfs is not available, fall back to lspci
+        return check_vfio_driver_lspci(first_only)
+
+    if not nvidia_devices:
+        print("No NVIDIA devices found to check.")
+        return False
+
+    vfio_found = False
+    for pci_addr in nvidia_devices:
+        print(f"Found NVIDIA device: {pci_addr}")
+        if get_pci_driver(pci_addr) == 'vfio-pci':
+            print("--> Kernel driver in use: vfio-pci (SUCCESS)")
+            if first_only:
+                return True
+            vfio_found = True
+        else:
+            print("--> VFIO driver NOT in use. Check your GRUB configuration.")
+
+    return vfio_found
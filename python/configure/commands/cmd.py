@@ -4,6 +4,10 @@ from typing import Any, Dict
 class BaseCmd(ABC):
     """ Base class for all commands."""
 
+    # Commands that neither prompt nor depend on other commands can run concurrently
+    # with adjacent parallel-safe commands in a workflow.
+    parallel_safe: bool = False
+
     def name(self) -> str:
         return self.__class__.__name__
     
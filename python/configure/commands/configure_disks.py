@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 
+import functools
 import os
+import re
 from typing import Any, Dict, Optional, Tuple
 
 from .cmd import BaseCmd
-from .utils import run, add_mp_to_fstab, CLOUDRIFT_MEDIA_MOUNT
+from .utils import run, add_mp_to_fstab, mounted_paths, require_binaries, CLOUDRIFT_MEDIA_MOUNT
 import json
-import shutil
 import subprocess
 
+__all__ = ["ConfigureDisksCmd"]
+
 
 def get_lvm_free_space() -> Optional[Tuple[str, float]]:
     """
@@ -55,34 +58,54 @@ def create_lvm_logical_volume(vg_name: str) -> str:
     print(f"Created logical volume: {lv_path}")
     return lv_path
 
-def find_unused_whole_disks(add_dev_prefix=False):
-    # Use lsblk JSON; suppress stderr warnings like "not a block device"
+LSBLK_PAIR_RE = re.compile(r'([A-Z]+)="([^"]*)"')
+
+@functools.lru_cache(maxsize=None)
+def _scan_unused_whole_disks() -> tuple[str, ...]:
+    # Use lsblk pair output, one device per line; suppress stderr warnings like "not a block device"
     out, _, _ = run(
-        ["lsblk", "-J", "-o", "NAME,TYPE,MOUNTPOINT"],
+        ["lsblk", "-P", "-o", "NAME,TYPE,PKNAME,MOUNTPOINT,FSTYPE"],
         capture_output=True,
         quiet_stderr=True,
     )
-    data = json.loads(out)
+    devices = [dict(LSBLK_PAIR_RE.findall(line)) for line in out.splitlines()]
+    # Disks with partitions, LVM volumes or RAID members show up as a parent of another device
+    parents = {dev.get("PKNAME") for dev in devices}
+
     disks = []
-    for dev in data.get("blockdevices", []):
-        # Select only whole disks: type=="disk", no children, no mountpoint
-        if (
-            dev.get("type") == "disk"
-            and not dev.get("children")
-            and dev.get("mountpoint") in (None, "")
-        ):
-            name = dev.get("name")
-            if not name:
-                continue
-            disks.append(f"/dev/{name}" if add_dev_prefix else name)
-    return disks
+    for dev in devices:
+        # Select only whole disks: type=="disk", no children, no mountpoint and no filesystem,
+        # so an unmounted disk formatted by an earlier run is never reformatted
+        name = dev.get("NAME")
+        if (name and dev.get("TYPE") == "disk" and name not in parents and not dev.get("MOUNTPOINT")
+                and not dev.get("FSTYPE")):
+            disks.append(name)
+    return tuple(disks)
+
+def find_unused_whole_disks(add_dev_prefix=False):
+    disks = _scan_unused_whole_disks()
+    return [f"/dev/{name}" for name in disks] if add_dev_prefix else list(disks)
 
 def reload_daemon():
     run(["systemctl", "daemon-reload"])
 
-def add_to_fstab(dev, mp):
-    run(["udevadm", "trigger"])
-    uuid, _, _ = run(["blkid", "-s", "UUID", "-o", "value", dev], capture_output=True)
+def blkid_uuids(devs: list[str]) -> dict[str, str]:
+    """
+    Looks up the filesystem UUIDs of several devices with a single blkid call.
+    Returns a map of device path to UUID.
+    """
+    out, _, _ = run(["blkid", "-o", "export", "-s", "UUID", *devs], capture_output=True)
+    uuids = {}
+    devname = None
+    for line in out.splitlines():
+        key, _, value = line.partition("=")
+        if key == "DEVNAME":
+            devname = value
+        elif key == "UUID" and devname:
+            uuids[devname] = value
+    return uuids
+
+def add_to_fstab(dev, mp, uuid):
     print(f"Adding {dev} with UUID {uuid} to /etc/fstab at mount point {mp}")
     # For LVM volumes, use noatime and defaults, for regular disks use nofail and discard
     if "/dev/mapper/" in dev or "-vg-" in dev:
@@ -91,14 +114,29 @@ def add_to_fstab(dev, mp):
         fstab_line = f"UUID={uuid} {mp} ext4 defaults,nofail,discard 0 0\n"
     add_mp_to_fstab(fstab_line, mp)
 
+def add_mounts_to_fstab(mounts: list[Tuple[str, str]]) -> None:
+    """
+    Adds (device, mount point) pairs to /etc/fstab, triggering udev and reading UUIDs once for all devices.
+    """
+    run(["udevadm", "trigger"])
+    uuids = blkid_uuids([dev for dev, _ in mounts])
+    for dev, mp in mounts:
+        if dev not in uuids:
+            raise RuntimeError(f"Could not determine UUID of {dev}")
+        add_to_fstab(dev, mp, uuids[dev])
+    reload_daemon()
+
 
 def mount_media_disk(dev, mp):
     run(["mkdir", "-p", mp])
     run(["mount", dev, mp])
+    mounted_paths.cache_clear()
 
 def create_filesystem(dev, label="cloudrift"):
     # Use -m 0 to reserve 0% for root (maximizing available space)
-    run(["mkfs.ext4", "-m", "0", "-L", label, dev])
+    # -q drops the progress output but, unlike redirecting stdout, keeps mke2fs
+    # asking before it overwrites an existing filesystem
+    run(["mkfs.ext4", "-q", "-m", "0", "-L", label, dev])
 
 def create_raid_array(disks):
     cmd = ["mdadm", "--create", "--verbose", "/dev/md0", "--level=0", "--raid-devices={}".format(len(disks))]
@@ -107,13 +145,16 @@ def create_raid_array(disks):
     cmd.extend(devices)
     run(cmd)
 
-def configure_lvm_storage(vg_name: str, free_gb: float) -> None:
+def configure_lvm_storage(vg_name: str, free_gb: float) -> list[Tuple[str, str]]:
     """
     Configure storage using LVM free space.
 
     Args:
         vg_name: Volume group name with free space
         free_gb: Amount of free space in GB
+
+    Returns:
+        (device, mount point) pairs to add to /etc/fstab
     """
     print(f"Using LVM free space: {free_gb:.1f}GB in volume group '{vg_name}'")
 
@@ -129,22 +170,22 @@ def configure_lvm_storage(vg_name: str, free_gb: float) -> None:
     # Add to fstab (will use the device mapper path)
     # The actual device path might be /dev/mapper/vg_name-lv_name
     mapper_path = f"/dev/mapper/{vg_name.replace('-', '--')}-cloudrift"
-    if os.path.exists(mapper_path):
-        add_to_fstab(mapper_path, CLOUDRIFT_MEDIA_MOUNT)
-    else:
-        add_to_fstab(lv_path, CLOUDRIFT_MEDIA_MOUNT)
+    fstab_dev = mapper_path if os.path.exists(mapper_path) else lv_path
 
-    reload_daemon()
     print(f"Successfully configured LVM logical volume at {CLOUDRIFT_MEDIA_MOUNT}")
+    return [(fstab_dev, CLOUDRIFT_MEDIA_MOUNT)]
 
 
-def configure_regular_disks(disks: list) -> None:
+def configure_regular_disks(disks: list) -> list[Tuple[str, str]]:
     """
     Configure storage using regular disks (single disk or RAID).
 
     Args:
         disks: List of unused disk names
 
+    Returns:
+        (device, mount point) pairs to add to /etc/fstab
+
     Raises:
         RuntimeError: If no disks are available
     """
@@ -159,17 +200,15 @@ def configure_regular_disks(disks: list) -> None:
 
         create_filesystem(disk_path)
         mount_media_disk(disk_path, CLOUDRIFT_MEDIA_MOUNT)
-        add_to_fstab(disk_path, CLOUDRIFT_MEDIA_MOUNT)
-        reload_daemon()
         print(f"Successfully configured single disk at {CLOUDRIFT_MEDIA_MOUNT}")
+        return [(disk_path, CLOUDRIFT_MEDIA_MOUNT)]
     else:
         # Multiple disks - create RAID
         create_raid_array(disks)
         create_filesystem("/dev/md0")
         mount_media_disk("/dev/md0", CLOUDRIFT_MEDIA_MOUNT)
-        add_to_fstab("/dev/md0", CLOUDRIFT_MEDIA_MOUNT)
-        reload_daemon()
         print(f"Successfully configured RAID array at {CLOUDRIFT_MEDIA_MOUNT}")
+        return [("/dev/md0", CLOUDRIFT_MEDIA_MOUNT)]
 
 
 def configure_disks():
@@ -178,9 +217,7 @@ def configure_disks():
     Checks for LVM free space first, then falls back to regular disks.
     """
     # Validate dependencies we directly call
-    for bin_name in ("lsblk", "systemctl", "bash", "vgs", "lvcreate"):
-        if shutil.which(bin_name) is None:
-            raise RuntimeError(f"Missing required command: {bin_name}")
+    require_binaries(("lsblk", "systemctl", "bash", "vgs", "lvcreate"))
 
     # First, check if there's free space in LVM
     lvm_info = get_lvm_free_space()
@@ -188,11 +225,14 @@ def configure_disks():
     if lvm_info:
         # Use LVM free space
         vg_name, free_gb = lvm_info
-        configure_lvm_storage(vg_name, free_gb)
+        mounts = configure_lvm_storage(vg_name, free_gb)
     else:
         # No LVM free space, check for unused disks
         disks = find_unused_whole_disks(add_dev_prefix=False)
-        configure_regular_disks(disks)
+        mounts = configure_regular_disks(disks)
+
+    # Persist all new mounts with one udev trigger and one blkid lookup
+    add_mounts_to_fstab(mounts)
 
 class ConfigureDisksCmd(BaseCmd):
     """ Command to configure disks. """
@@ -205,8 +245,8 @@ class ConfigureDisksCmd(BaseCmd):
 
     def execute(self, env: Dict[str, Any]) -> bool:
         try:
-            if os.path.exists(CLOUDRIFT_MEDIA_MOUNT):
-                print(f"{CLOUDRIFT_MEDIA_MOUNT} already exists, skipping disk configuration.")
+            if CLOUDRIFT_MEDIA_MOUNT in mounted_paths():
+                print(f"{CLOUDRIFT_MEDIA_MOUNT} is already mounted, skipping disk configuration.")
                 return True
             configure_disks()
             return True
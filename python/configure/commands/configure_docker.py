@@ -2,7 +2,9 @@ import subprocess
 import os
 from typing import Any, Dict
 from .cmd import BaseCmd
-from .utils import run
+from .utils import run, dpkg_arch, ensure_apt_updated, get_installed_packages, get_os_codename
+
+__all__ = ["ConfigureDockerCmd"]
 
 class ConfigureDockerCmd(BaseCmd):
     """Command to install and configure Docker."""
@@ -29,18 +31,22 @@ class ConfigureDockerCmd(BaseCmd):
                 "runc"
             ]
 
-            for pkg in conflicting_packages:
-                try:
-                    # Use --purge to remove config files and ignore if package doesn't exist
-                    run(["apt-get", "remove", "-y", "--purge", pkg], check=False)
-                except:
-                    pass  # Package might not be installed
+            # Only pass packages that are actually installed; apt-get fails on unknown names
+            installed = get_installed_packages()
+            if installed is not None:
+                conflicting_packages = [pkg for pkg in conflicting_packages if pkg in installed]
+
+            if conflicting_packages:
+                # Use --purge to remove config files as well
+                run(["apt-get", "remove", "-y", "--purge", *conflicting_packages], check=False)
+            else:
+                print("   No conflicting packages installed.")
 
             # Step 2: Setup repository
             print("🔑 Setting up Docker repository...")
 
             # Update apt and install prerequisites
-            run(["apt-get", "update"])
+            ensure_apt_updated()
             run(["apt-get", "install", "-y", "ca-certificates", "curl"])
 
             # Create keyrings directory
@@ -58,28 +64,26 @@ class ConfigureDockerCmd(BaseCmd):
             print("📝 Adding Docker repository to apt sources...")
 
             # Get architecture and Ubuntu codename
-            arch_result = subprocess.run(["dpkg", "--print-architecture"],
-                                       capture_output=True, text=True, check=True)
-            architecture = arch_result.stdout.strip()
+            architecture = dpkg_arch()
 
             # Get Ubuntu version codename
-            with open("/etc/os-release", "r") as f:
-                os_release = f.read()
-                for line in os_release.split('\n'):
-                    if line.startswith("VERSION_CODENAME="):
-                        codename = line.split('=')[1].strip('"')
-                        break
+            codename = get_os_codename()
+            if not codename:
+                print("❌ Could not determine VERSION_CODENAME from /etc/os-release")
+                return False
 
             # Create Docker repository entry
             repo_entry = f"deb [arch={architecture} signed-by={docker_gpg_path}] " \
                         f"https://download.docker.com/linux/ubuntu {codename} stable"
 
-            with open("/etc/apt/sources.list.d/docker.list", "w") as f:
+            docker_list_path = "/etc/apt/sources.list.d/docker.list"
+            with open(docker_list_path, "w") as f:
                 f.write(repo_entry + "\n")
 
             # Step 3: Install Docker packages
             print("📥 Installing Docker packages...")
-            run(["apt-get", "update"])
+            # The Docker repository was just added, so its list must be refreshed
+            ensure_apt_updated(force=True, source_list=docker_list_path)
 
             docker_packages = [
                 "docker-ce",
@@ -98,8 +102,7 @@ class ConfigureDockerCmd(BaseCmd):
             print(f"   Docker version: {result.stdout.strip()}")
 
             # Optional: Start and enable Docker service
-            run(["systemctl", "start", "docker"])
-            run(["systemctl", "enable", "docker"])
+            run(["systemctl", "enable", "--now", "docker"])
 
             print("🎉 Docker installation completed successfully!")
             return True
@@ -2,17 +2,19 @@ import os
 import subprocess
 from typing import Any, Dict
 from .cmd import BaseCmd
-from .utils import run
+from .utils import atomic_write_bytes, file_matches, run, nvidia_pci_devices, PCI_DEVICES_DIR
+
+__all__ = [
+    "ConfigureGpuPowerCmd",
+    "CreateGpuPowerUdevRuleCmd",
+    "CreateVfioPciPowerConfCmd",
+    "VerifyGpuPowerStateCmd",
+]
 
 UDEV_RULE_FILE = '/etc/udev/rules.d/99-vfio-nvidia-power.rules'
 MODPROBE_CONF_FILE = '/etc/modprobe.d/vfio-pci-power.conf'
 
-def create_gpu_power_udev_rule():
-    """
-    Creates udev rule to prevent NVIDIA GPU from going into deep D3 state.
-    Returns: 'created' if rule was created/updated, 'exists' if already correct, 'error' on failure.
-    """
-    udev_rule_content = '''# Keep all NVIDIA PCI functions in D0 (no runtime suspend / no D3cold)
+UDEV_RULE_CONTENT = b'''# Keep all NVIDIA PCI functions in D0 (no runtime suspend / no D3cold)
 # Match all NVIDIA devices and set power management
 ACTION=="add|change", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", \\
   RUN+="/bin/sh -c 'echo on > /sys$devpath/power/control 2>/dev/null || true; echo 0 > /sys$devpath/d3cold_allowed 2>/dev/null || true'"
@@ -22,26 +24,30 @@ ACTION=="bind", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", \\
   RUN+="/bin/sh -c 'echo on > /sys$devpath/power/control 2>/dev/null || true; echo 0 > /sys$devpath/d3cold_allowed 2>/dev/null || true'"
 '''
 
+MODPROBE_CONF_CONTENT = b"options vfio-pci disable_idle_d3=1\n"
+
+def create_gpu_power_udev_rule():
+    """
+    Creates udev rule to prevent NVIDIA GPU from going into deep D3 state.
+    Returns: 'created' if rule was created/updated, 'exists' if already correct, 'error' on failure.
+    """
     try:
         # Check if rule already exists and has same content
-        if os.path.exists(UDEV_RULE_FILE):
-            with open(UDEV_RULE_FILE, 'r') as f:
-                existing_content = f.read()
-                if existing_content == udev_rule_content:
-                    print(f"Udev rule {UDEV_RULE_FILE} already exists with correct content.")
-                    return 'exists'
+        if file_matches(UDEV_RULE_FILE, UDEV_RULE_CONTENT):
+            print(f"Udev rule {UDEV_RULE_FILE} already exists with correct content.")
+            return 'exists'
 
         # Write the udev rule
-        with open(UDEV_RULE_FILE, 'w') as f:
-            f.write(udev_rule_content)
+        atomic_write_bytes(UDEV_RULE_FILE, UDEV_RULE_CONTENT)
         print(f"Created/updated udev rule: {UDEV_RULE_FILE}")
 
         # Reload udev rules
         run(['udevadm', 'control', '--reload'], check=True)
         print("Reloaded udev rules.")
 
-        # Trigger udev for existing devices
-        run(['udevadm', 'trigger', '--subsystem-match=pci', '--attr-match=vendor=0x10de'], check=False)
+        # Trigger udev for existing devices. --settle waits only for these events to be
+        # processed, not the whole udev queue, so verification sees the final state
+        run(['udevadm', 'trigger', '--settle', '--subsystem-match=pci', '--attr-match=vendor=0x10de'], check=False)
         print("Triggered udev for existing NVIDIA devices.")
 
         return 'created'
@@ -52,53 +58,54 @@ ACTION=="bind", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", \\
         print(f"Error reloading udev rules: {e}")
         return 'error'
 
+def _write_sysfs_attr(path, value):
+    """
+    Writes a value to a sysfs attribute with a single write() call.
+    """
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.write(fd, value)
+    finally:
+        os.close(fd)
+
 def apply_gpu_power_settings_immediately():
     """
     Immediately apply GPU power settings to all NVIDIA devices.
     """
+    print("Applying power settings to NVIDIA devices...")
     try:
-        # Use a shell command to apply settings
-        # Single line command to avoid shell parsing issues
-        cmd = 'for dev in /sys/bus/pci/devices/*/vendor; do [ "$(cat $dev 2>/dev/null)" = "0x10de" ] && pci=${dev%/vendor} && echo on > $pci/power/control 2>/dev/null && echo 0 > $pci/d3cold_allowed 2>/dev/null && echo "  Configured: $(basename $pci)"; done'
-
-        print("Applying power settings to NVIDIA devices...")
-        stdout, stderr, returncode = run(['sh', '-c', cmd], capture_output=True, check=False)
-
-        if stdout:
-            print(stdout)
+        nvidia_devices = nvidia_pci_devices()
+    except OSError as e:
+        print(f"Note: Could not enumerate PCI devices: {e}")
+        return True  # Continue anyway since we'll verify below
 
-        # Don't fail even if the command returns non-zero - sometimes it's due to permission on some files
-        # We'll verify the actual state below
-        print("Power settings application completed.")
-        return True
+    for device in nvidia_devices:
+        device_dir = os.path.join(PCI_DEVICES_DIR, device)
+        try:
+            _write_sysfs_attr(os.path.join(device_dir, 'power/control'), b'on')
+            _write_sysfs_attr(os.path.join(device_dir, 'd3cold_allowed'), b'0')
+            print(f"  Configured: {device}")
+        except OSError as e:
+            # Some devices may not expose these attributes or may refuse the write
+            print(f"  Could not configure {device}: {e}")
 
-    except subprocess.CalledProcessError as e:
-        # This shouldn't happen with check=False, but keep it for safety
-        print(f"Note: Power settings command returned an error, but this may be normal: {e}")
-        return True  # Continue anyway since we'll verify below
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        return True  # Continue anyway since we'll verify below
+    # Don't fail on write errors - we'll verify the actual state below
+    print("Power settings application completed.")
+    return True
 
 def create_vfio_pci_power_conf():
     """
     Creates modprobe configuration to disable idle D3 for vfio-pci.
     Returns: 'created' if conf was created/updated, 'exists' if already correct, 'error' on failure.
     """
-    conf_content = "options vfio-pci disable_idle_d3=1\n"
-
     try:
         # Check if conf already exists and has same content
-        if os.path.exists(MODPROBE_CONF_FILE):
-            with open(MODPROBE_CONF_FILE, 'r') as f:
-                existing_content = f.read()
-                if existing_content == conf_content:
-                    print(f"Modprobe conf {MODPROBE_CONF_FILE} already exists with correct content.")
-                    return 'exists'
+        if file_matches(MODPROBE_CONF_FILE, MODPROBE_CONF_CONTENT):
+            print(f"Modprobe conf {MODPROBE_CONF_FILE} already exists with correct content.")
+            return 'exists'
 
         # Write the modprobe conf
-        with open(MODPROBE_CONF_FILE, 'w') as f:
-            f.write(conf_content)
+        atomic_write_bytes(MODPROBE_CONF_FILE, MODPROBE_CONF_CONTENT)
         print(f"Created/updated modprobe conf: {MODPROBE_CONF_FILE}")
 
         return 'created'
@@ -106,6 +113,33 @@ def create_vfio_pci_power_conf():
         print(f"Error writing modprobe conf to {MODPROBE_CONF_FILE}: {e}")
         return 'error'
 
+def _read_sysfs_attr(path):
+    """
+    Reads a small sysfs attribute as raw bytes (including the trailing newline),
+    or returns None if it does not exist.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        return os.read(fd, 64)
+    finally:
+        os.close(fd)
+
+def read_gpu_power_states(devices):
+    """
+    Reads power/control and d3cold_allowed for all devices up front.
+    Returns a list of (device, power_control, d3cold_allowed) with raw bytes values.
+    """
+    states = []
+    for device in devices:
+        device_dir = os.path.join(PCI_DEVICES_DIR, device)
+        states.append((device,
+                       _read_sysfs_attr(os.path.join(device_dir, 'power/control')),
+                       _read_sysfs_attr(os.path.join(device_dir, 'd3cold_allowed'))))
+    return states
+
 def verify_gpu_power_state():
     """
     Verifies that GPU power management is correctly configured.
@@ -129,48 +163,31 @@ def verify_gpu_power_state():
 
     # Check current GPU power states
     try:
-        # Find NVIDIA GPU devices
-        lspci_output = subprocess.check_output(['lspci', '-d', '10de:', '-D'], text=True)
-        nvidia_devices = []
-        for line in lspci_output.strip().split('\n'):
-            if line:
-                # Extract PCI address (e.g., 0000:01:00.0)
-                pci_addr = line.split()[0]
-                nvidia_devices.append(pci_addr)
+        nvidia_devices = nvidia_pci_devices()
 
         if nvidia_devices:
             print(f"\nFound {len(nvidia_devices)} NVIDIA device(s):")
-            for device in nvidia_devices:
+            for device, power_state, d3cold_state in read_gpu_power_states(nvidia_devices):
                 # Check power control
-                power_control_path = f'/sys/bus/pci/devices/{device}/power/control'
-                d3cold_path = f'/sys/bus/pci/devices/{device}/d3cold_allowed'
-
-                if os.path.exists(power_control_path):
-                    with open(power_control_path, 'r') as f:
-                        power_state = f.read().strip()
-                    print(f"  {device}: power/control = {power_state}", end='')
-                    if power_state != 'on':
+                if power_state is not None:
+                    print(f"  {device}: power/control = {power_state.decode().strip()}", end='')
+                    if power_state != b'on\n':
                         print(" (WARNING: should be 'on')")
                         verification_passed = False
                     else:
                         print(" ✓")
 
-                if os.path.exists(d3cold_path):
-                    with open(d3cold_path, 'r') as f:
-                        d3cold_state = f.read().strip()
-                    print(f"           d3cold_allowed = {d3cold_state}", end='')
-                    if d3cold_state != '0':
+                if d3cold_state is not None:
+                    print(f"           d3cold_allowed = {d3cold_state.decode().strip()}", end='')
+                    if d3cold_state != b'0\n':
                         print(" (WARNING: should be '0')")
                         verification_passed = False
                     else:
                         print(" ✓")
         else:
             print("\nNo NVIDIA devices found in the system.")
-    except subprocess.CalledProcessError as e:
-        print(f"\nError checking GPU devices: {e}")
-        verification_passed = False
-    except IOError as e:
-        print(f"\nError reading power state files: {e}")
+    except OSError as e:
+        print(f"\nError reading GPU power state from sysfs: {e}")
         verification_passed = False
 
     return verification_passed
@@ -272,8 +289,7 @@ class ConfigureGpuPowerCmd(BaseCmd):
             return True
         else:
             print("\nWarning: Some verification checks failed. Settings have been applied but may require a reboot for full effect.")
-            # Return True anyway if the files were created, as the settings will take effect on reboot
-            if os.path.exists(UDEV_RULE_FILE) and os.path.exists(MODPROBE_CONF_FILE):
-                print("Configuration files are in place. Settings will be fully applied after reboot.")
-                return True
-            return False
\ No newline at end of file
+            # Both writers succeeded, so the configuration files are in place and
+            # the settings will take effect on reboot
+            print("Configuration files are in place. Settings will be fully applied after reboot.")
+            return True
\ No newline at end of file
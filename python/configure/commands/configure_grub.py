@@ -1,31 +1,80 @@
 from .cmd import BaseCmd
-from .utils import run
+from .utils import atomic_write_bytes, cpuinfo, nvidia_pci_devices, schedule_boot_update, NVIDIA_PCI_VENDOR, PCI_DEVICES_DIR
 from typing import Dict, Any
+import functools
 import os
 import re
 import subprocess
 
+__all__ = [
+    "AddGrubVirtualizationOptionsCmd",
+    "CreateGrubOverrideCmd",
+    "GetGpuPciIdsCmd",
+    "GetIommuTypeCmd",
+    "ReadGrubCmd",
+    "RemoveGrubOverrideCmd",
+]
+
 GRUB_MAIN_FILE = '/etc/default/grub'
 GRUB_D_DIR = '/etc/default/grub.d'
 VFIO_GRUB_FILE = os.path.join(GRUB_D_DIR, '99-cloudrift.cfg')
 
+GRUB_ASSIGNMENT_RE = re.compile(rb'([A-Z_]+)="([^"]*)"')
+
 def update_grub():
     """
-    Updates GRUB configuration by running 'update-grub'.
+    Queues an 'update-grub' run, see schedule_boot_update().
     """
-    print("Updating GRUB configuration...")
-    run(['update-grub'], check=True)
-    print("GRUB configuration updated.")
+    print("GRUB configuration will be updated at the end of the run.")
+    schedule_boot_update('grub', ['update-grub'])
+
+@functools.lru_cache(maxsize=None)
+def _grub_param_pattern(param_name):
+    # Anchored to the line start so commented out assignments are ignored
+    return re.compile(r'^[ \t]*' + re.escape(param_name) + r'="([^"]*)"', re.MULTILINE)
+
+def options_from_text(text, param_name):
+    return [opt for match in _grub_param_pattern(param_name).finditer(text) for opt in match.group(1).split()]
 
 def read_options_from_file(file_path, param_name):
-    all_options = []
     with open(file_path, 'r') as f:
-        for line in f:
-            if param_name in line:
-                match = re.search(param_name + r'="([^"]*)"', line)
-                if match:
-                    all_options.extend(match.group(1).split())
-    return all_options
+        return options_from_text(f.read(), param_name)
+
+@functools.lru_cache(maxsize=None)
+def grub_sources() -> tuple[str, ...]:
+    """
+    Returns the contents of /etc/default/grub followed by the overrides in
+    /etc/default/grub.d, in the order GRUB applies them. Cached so reading several
+    parameters opens each file only once; cleared when the override file changes.
+    """
+    texts = []
+    try:
+        with open(GRUB_MAIN_FILE, 'r') as f:
+            texts.append(f.read())
+    except FileNotFoundError:
+        print(f"Warning: {GRUB_MAIN_FILE} not found. Starting with an empty command line.")
+
+    try:
+        with os.scandir(GRUB_D_DIR) as it:
+            entries = sorted((entry for entry in it if entry.name.endswith('.cfg') and entry.is_file()),
+                             key=lambda entry: entry.name)
+    except FileNotFoundError:
+        entries = []
+    for entry in entries:
+        try:
+            with open(entry.path, 'r') as f:
+                texts.append(f.read())
+        except IOError as e:
+            print(f"Warning: Could not read {entry.path}: {e}")
+    return tuple(texts)
+
+def option_key(opt):
+    """
+    Returns the key used to detect duplicate kernel options, e.g. 'iommu' for 'iommu=pt'.
+    The kernel accepts several 'pci=' flags, so those are compared by their full value.
+    """
+    key = opt.partition('=')[0]
+    return opt if key == 'pci' else key
 
 def get_existing_grub_parameters(param_name):
     """
@@ -35,27 +84,10 @@ def get_existing_grub_parameters(param_name):
     Returns:
         A string containing all existing kernel parameters.
     """
-    all_options = []
-
-    # Read from the main GRUB file
-    try:
-        all_options = read_options_from_file(GRUB_MAIN_FILE, param_name)
-    except FileNotFoundError:
-        print(f"Warning: {GRUB_MAIN_FILE} not found. Starting with an empty command line.")
-
-    # Read from override files in grub.d
-    if os.path.exists(GRUB_D_DIR):
-        for filename in sorted(os.listdir(GRUB_D_DIR)):
-            if filename.endswith('.cfg'):
-                filepath = os.path.join(GRUB_D_DIR, filename)
-                try:
-                    all_options.extend(read_options_from_file(filepath, param_name))
-                except IOError as e:
-                    print(f"Warning: Could not read {filepath}: {e}")
+    all_options = [opt for text in grub_sources() for opt in options_from_text(text, param_name)]
 
-    # Deduplicate and return as a list
-    unique_options = sorted(list(set(all_options)))
-    return unique_options
+    # Deduplicate, keeping the command line order
+    return list(dict.fromkeys(all_options))
 
 def create_grub_override(grub_options: Dict[str, Any]) -> bool:
     """
@@ -66,47 +98,50 @@ def create_grub_override(grub_options: Dict[str, Any]) -> bool:
         grub_options: A dictionary of kernel parameters with options to add.
     """
 
-    if os.path.exists(VFIO_GRUB_FILE):
+    # Options read from GRUB are lists, options built by AddGrubVirtualizationOptionsCmd are strings
+    grub_options = {key: ' '.join(value) if isinstance(value, list) else value
+                    for key, value in grub_options.items()}
+
+    try:
+        with open(VFIO_GRUB_FILE, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = None
+    except IOError as e:
+        print(f"Warning: Could not read existing file {VFIO_GRUB_FILE}: {e}")
+        data = None
+
+    if data is not None:
         print(f"Warning: {VFIO_GRUB_FILE} already exists and will be overwritten.")
         # Check existing options in the file
-        existing_options = {}
-        if os.path.exists(VFIO_GRUB_FILE):
-            try:
-                with open(VFIO_GRUB_FILE, 'r') as f:
-                    for line in f:
-                        match = re.search(r'([A-Z_]+)="([^"]*)"', line)
-                        if match:
-                            existing_options[match.group(1)] = match.group(2)
-                
-                # Compare existing with new options
-                if existing_options == grub_options:
-                    print("GRUB options are already up to date. No changes needed.")
-                    return False
-                else:
-                    print("Existing options differ from new options:")
-                    for k in set(existing_options.keys()) | set(grub_options.keys()):
-                        if k in existing_options and k in grub_options:
-                            print(f"  {k}: '{existing_options[k]}' -> '{grub_options[k]}'")
-                        elif k in grub_options:
-                            print(f"  {k}: (none) -> '{grub_options[k]}'")
-                        else:
-                            print(f"  {k}: '{existing_options[k]}' -> (removed)")
-            except IOError as e:
-                print(f"Warning: Could not read existing file {VFIO_GRUB_FILE}: {e}")
-
-    # grub_d_content = f'GRUB_CMDLINE_LINUX_DEFAULT="{final_options_str}"\n'
-
-    grub_d_content = "\n".join([f'{key}="{grub_options[key]}"' for key in grub_options])
+        existing_options = dict(GRUB_ASSIGNMENT_RE.findall(data))
+        new_options = {key.encode(): value.encode() for key, value in grub_options.items()}
+
+        # Compare existing with new options
+        if existing_options == new_options:
+            print("GRUB options are already up to date. No changes needed.")
+            return False
+
+        print("Existing options differ from new options:")
+        for k in existing_options.keys() | new_options.keys():
+            if k in existing_options and k in new_options:
+                print(f"  {k.decode()}: '{existing_options[k].decode()}' -> '{new_options[k].decode()}'")
+            elif k in new_options:
+                print(f"  {k.decode()}: (none) -> '{new_options[k].decode()}'")
+            else:
+                print(f"  {k.decode()}: '{existing_options[k].decode()}' -> (removed)")
+
+    grub_d_content = b''.join(f'{key}="{value}"\n'.encode() for key, value in grub_options.items())
 
     print(f"Creating override file {VFIO_GRUB_FILE}...")
-    print(f"Adding line: {grub_d_content}")
+    print(f"Adding line: {grub_d_content.decode().rstrip()}")
 
     if not os.path.exists(GRUB_D_DIR):
         os.makedirs(GRUB_D_DIR)
 
     try:
-        with open(VFIO_GRUB_FILE, 'w') as f:
-            f.write(grub_d_content)
+        atomic_write_bytes(VFIO_GRUB_FILE, grub_d_content)
+        grub_sources.cache_clear()
         print("GRUB override file created successfully.")
         return True
     except IOError as e:
@@ -139,7 +174,7 @@ class GetIommuTypeCmd(BaseCmd):
 
     def execute(self, env: Dict[str, Any]) -> bool:
         iommu_type = 'intel_iommu=on'
-        if 'AMD' in open('/proc/cpuinfo').read():
+        if cpuinfo().get(b'vendor_id') == b'AuthenticAMD':
             iommu_type = 'amd_iommu=on'
         print(f"Detected CPU type, using '{iommu_type}'.")
         env['IOMMU_TYPE'] = iommu_type
@@ -155,6 +190,34 @@ class GetGpuPciIdsCmd(BaseCmd):
         return "Retrieves the PCI IDs of the GPUs in the system."
 
     def execute(self, env: Dict[str, Any]) -> bool:
+        try:
+            nvidia_devices = nvidia_pci_devices()
+        except OSError:
+            # sysfs is not available, fall back to lspci
+            return self.execute_lspci(env)
+
+        if not nvidia_devices:
+            print("No NVIDIA GPUs found.")
+            return False
+
+        pci_ids = []
+        for device in nvidia_devices:
+            try:
+                with open(os.path.join(PCI_DEVICES_DIR, device, 'device')) as f:
+                    device_id = f.read().strip().removeprefix('0x')
+            except OSError:
+                # The device went away or cannot be read, skip it
+                continue
+            pci_ids.append(f"{NVIDIA_PCI_VENDOR.removeprefix('0x')}:{device_id}")
+
+        if not pci_ids:
+            return self.execute_lspci(env)
+
+        env['GPU_PCI_IDS'] = sorted(set(pci_ids))
+        print(f"Detected GPU PCI IDs: {env['GPU_PCI_IDS']}")
+        return True
+
+    def execute_lspci(self, env: Dict[str, Any]) -> bool:
         try:
             lspci_output = subprocess.check_output(['lspci', '-nnk']).decode('utf-8')
             nvidia_lines = [line for line in lspci_output.splitlines() if 'NVIDIA Corporation' in line]
@@ -244,15 +307,17 @@ class AddGrubVirtualizationOptionsCmd(BaseCmd):
             # If it's a string, split it into a list
             final_options_list = grub_cmdline.split() if grub_cmdline else []
 
+        # Avoid duplicates for non-vfio options by comparing option keys
+        existing_keys = {option_key(opt) for opt in final_options_list}
         for opt in new_options:
-            # Simple check to avoid duplicates for non-vfio options
-            if not any(opt.split('=')[0] in existing_opt for existing_opt in final_options_list):
+            key = option_key(opt)
+            if key not in existing_keys:
                 final_options_list.append(opt)
+                existing_keys.add(key)
 
         # Handle the vfio-pci.ids and modprobe.blacklist options carefully
         # We remove the old ones if they exist and add our new, complete ones
-        final_options_list = [opt for opt in final_options_list if not opt.startswith('vfio-pci.ids=')]
-        final_options_list = [opt for opt in final_options_list if not opt.startswith('modprobe.blacklist=')]
+        final_options_list = [opt for opt in final_options_list if not opt.startswith(('vfio-pci.ids=', 'modprobe.blacklist='))]
         if not skip_vfio_binding:
             vfio_ids_str = ','.join(pci_ids)
             if vfio_ids_str:
@@ -276,6 +341,7 @@ class RemoveGrubOverrideCmd(BaseCmd):
         if os.path.exists(VFIO_GRUB_FILE):
             try:
                 os.remove(VFIO_GRUB_FILE)
+                grub_sources.cache_clear()
                 print(f"Removed GRUB override file {VFIO_GRUB_FILE}.")
                 update_grub()
                 return True
@@ -1,15 +1,16 @@
 from typing import Any, Dict
 
 from .cmd import BaseCmd
-from .utils import run
+from .utils import schedule_boot_update
+
+__all__ = ["UpdateInitramfsModulesCmd"]
 
 def update_initramfs():
     """
-    Updates the initramfs to include any changes made to modules.
+    Queues an initramfs update to include any changes made to modules.
     """
-    print("Updating initramfs...")
-    run(['update-initramfs', '-u', '-k', 'all'], check=True)
-    print("Initramfs updated.")
+    print("Initramfs will be updated at the end of the run.")
+    schedule_boot_update('initramfs', ['update-initramfs', '-u', '-k', 'all'])
 
 def update_initramfs_modules() -> bool:
     """
@@ -19,19 +20,22 @@ def update_initramfs_modules() -> bool:
     modules_to_add = ['vfio', 'vfio_iommu_type1', 'vfio_pci', 'vfio_virqfd']
 
     try:
-        with open(modules_file, 'r+') as f:
-            existing_modules = f.read()
-            f.seek(0, 0)
-
-            updated = False
-            for module in modules_to_add:
-                if f'\n{module}\n' not in existing_modules:
-                    f.write(f'{module}\n')
-                    updated = True
+        with open(modules_file, 'r') as f:
+            contents = f.read()
 
-            f.write(existing_modules)
+        present = set()
+        for line in contents.splitlines():
+            line = line.strip()
+            if line and not line.startswith('#'):
+                # A line may carry module arguments after the name
+                present.add(line.split()[0])
 
-        if updated:
+        missing = [module for module in modules_to_add if module not in present]
+        if missing:
+            with open(modules_file, 'a') as f:
+                if contents and not contents.endswith('\n'):
+                    f.write('\n')
+                f.write('\n'.join(missing) + '\n')
             print("VFIO modules added to /etc/initramfs-tools/modules.")
             return True
         else:
@@ -1,11 +1,29 @@
 from .cmd import BaseCmd
 from pathlib import Path
-from .utils import run
+import re
+from .utils import atomic_write_bytes, cpuinfo, schedule_restart, service_active_since
 from typing import Any, Dict
 
+__all__ = [
+    "CheckVirtualizationCmd",
+    "ConfigureLibvirtCmd",
+]
+
 QEMU_CONF = Path("/etc/libvirt/qemu.conf")
 
-def ensure_qemu_conf_lines() -> bool:
+QEMU_ROOT_KEYS = ('user', 'group')
+# Uncommented `key = "root"` lines
+ROOT_SETTING_RES = {key: re.compile(rf'^[ \t]*{key}[ \t]*=[ \t]*"root"', re.MULTILINE)
+                    for key in QEMU_ROOT_KEYS}
+# Whole `key = ...` lines, commented out or not
+SETTING_LINE_RES = {key: re.compile(rf'^[ \t]*#?[ \t]*{key}[ \t]*=.*$', re.MULTILINE)
+                    for key in QEMU_ROOT_KEYS}
+
+def ensure_qemu_conf_lines() -> tuple[bool, str]:
+    """
+    Sets user and group to root in qemu.conf.
+    Returns whether the file was modified and its resulting contents.
+    """
     print(f"Ensuring user/group lines in {QEMU_CONF} ...")
 
     # Create directory if it doesn't exist
@@ -15,112 +33,53 @@ def ensure_qemu_conf_lines() -> bool:
     contents = QEMU_CONF.read_text() if QEMU_CONF.exists() else ""
 
     # Check if user and group are already set (uncommented)
-    lines = contents.splitlines() if contents else []
-    user_configured = False
-    group_configured = False
-
-    for line in lines:
-        # Check for uncommented lines only
-        stripped = line.strip()
-        if not stripped.startswith('#'):
-            if 'user = "root"' in line:
-                user_configured = True
-            if 'group = "root"' in line:
-                group_configured = True
-
-    if user_configured and group_configured:
+    missing = [key for key in QEMU_ROOT_KEYS if not ROOT_SETTING_RES[key].search(contents)]
+    if not missing:
         print("User/group configuration already present; skipping.")
-        return False
+        return False, contents
+
+    original_contents = contents
+    for key in missing:
+        setting = f'{key} = "root"'
+        # Replace the first existing line for the key (commented or set to another value)
+        contents, replaced = SETTING_LINE_RES[key].subn(setting, contents, count=1)
+        if replaced:
+            print(f"Set {setting}")
+        else:
+            if contents and not contents.endswith('\n'):
+                contents += '\n'
+            contents += setting + '\n'
+            print(f"Added {setting} configuration")
 
-    # Process the configuration file line by line
-    lines = contents.splitlines() if contents else []
-    modified = False
-    user_found = False
-    group_found = False
-
-    for i, line in enumerate(lines):
-        # Check for commented user line (only process if not already found)
-        if not user_found and line.strip().startswith('#') and 'user =' in line:
-            # Uncomment the line and set to root
-            lines[i] = 'user = "root"'
-            user_found = True
-            modified = True
-            print(f"Uncommented and set user = \"root\"")
-        # Check for uncommented user line that's not root
-        elif not user_found and line.strip().startswith('user =') and 'user = "root"' not in line:
-            lines[i] = 'user = "root"'
-            user_found = True
-            modified = True
-            print(f"Updated existing user setting to root")
-        elif not user_found and 'user = "root"' in line and not line.strip().startswith('#'):
-            user_found = True
-
-        # Check for commented group line (only process if not already found)
-        if not group_found and line.strip().startswith('#') and 'group =' in line:
-            # Uncomment the line and set to root
-            lines[i] = 'group = "root"'
-            group_found = True
-            modified = True
-            print(f"Uncommented and set group = \"root\"")
-        # Check for uncommented group line that's not root
-        elif not group_found and line.strip().startswith('group =') and 'group = "root"' not in line:
-            lines[i] = 'group = "root"'
-            group_found = True
-            modified = True
-            print(f"Updated existing group setting to root")
-        elif not group_found and 'group = "root"' in line and not line.strip().startswith('#'):
-            group_found = True
-
-    # If user or group not found, append them
-    if not user_found:
-        lines.append('user = "root"')
-        modified = True
-        print("Added user = \"root\" configuration")
-
-    if not group_found:
-        lines.append('group = "root"')
-        modified = True
-        print("Added group = \"root\" configuration")
-
-    # Write back if modifications were made
-    if modified:
-        try:
-            with QEMU_CONF.open("w") as f:
-                f.write('\n'.join(lines) + '\n')
-            print("Updated qemu.conf configuration.")
-            return True
-        except Exception as e:
-            print(f"Error updating qemu.conf: {e}")
-            return False
+    if not contents.endswith('\n'):
+        contents += '\n'
 
-    return False
+    try:
+        atomic_write_bytes(QEMU_CONF, contents.encode())
+        print("Updated qemu.conf configuration.")
+        return True, contents
+    except Exception as e:
+        print(f"Error updating qemu.conf: {e}")
+        return False, original_contents
 
 def restart_libvirtd():
-    svc = "libvirtd"
-    print(f"Restarting {svc} service...")
-    run(["systemctl", "restart", svc])
-    run(["systemctl", "is-active", "--quiet", svc])
-    print(f"{svc} is active.")
-
-def verify_qemu_conf() -> bool:
-    """Verify that qemu.conf has the user and group settings."""
+    # Restarted together with other changed services once the workflow is done
+    print("Scheduling libvirtd restart...")
+    schedule_restart("libvirtd")
+
+def verify_qemu_conf(contents: str | None = None) -> bool:
+    """
+    Verify that qemu.conf has the user and group settings.
+    Checks the given contents if they are already known, otherwise reads the file.
+    """
     print("Verifying libvirt qemu.conf configuration...")
 
     try:
-        contents = QEMU_CONF.read_text() if QEMU_CONF.exists() else ""
-
-        lines = contents.splitlines()
-        user_ok = False
-        group_ok = False
+        if contents is None:
+            contents = QEMU_CONF.read_text() if QEMU_CONF.exists() else ""
 
-        for line in lines:
-            stripped = line.strip()
-            # Only count uncommented lines
-            if not stripped.startswith('#'):
-                if 'user = "root"' in line:
-                    user_ok = True
-                if 'group = "root"' in line:
-                    group_ok = True
+        user_ok = ROOT_SETTING_RES['user'].search(contents) is not None
+        group_ok = ROOT_SETTING_RES['group'].search(contents) is not None
 
         print(f"  {'✓' if user_ok else '✗'} User set to root")
         print(f"  {'✓' if group_ok else '✗'} Group set to root")
@@ -141,12 +100,19 @@ class ConfigureLibvirtCmd(BaseCmd):
         return "Sets up libvirt."
 
     def execute(self, env: Dict[str, Any]) -> bool:
-        changes_made = ensure_qemu_conf_lines()
+        changes_made, contents = ensure_qemu_conf_lines()
         if changes_made:
             restart_libvirtd()
-
-        # Verify the configuration
-        if verify_qemu_conf():
+        else:
+            # The file is already correct, but libvirtd still needs a restart if a previous
+            # run changed it and the daemon has been running since before that
+            started_at = service_active_since("libvirtd")
+            if started_at is not None and QEMU_CONF.exists() and started_at < QEMU_CONF.stat().st_mtime:
+                print("libvirtd was started before qemu.conf was last changed.")
+                restart_libvirtd()
+
+        # Verify the configuration without reading the file again
+        if verify_qemu_conf(contents):
             print("Libvirt configuration completed successfully.")
             return True
         else:
@@ -156,6 +122,8 @@ class ConfigureLibvirtCmd(BaseCmd):
 class CheckVirtualizationCmd(BaseCmd):
     """ Command to check if virtualization is supported. """
 
+    parallel_safe = True
+
     def name(self) -> str:
         return "Check Virtualization Support"
 
@@ -164,8 +132,8 @@ class CheckVirtualizationCmd(BaseCmd):
 
     def execute(self, env: Dict[str, Any]) -> bool:
         print("Checking for virtualization support...")
-        cpuinfo, _, _ = run(["grep", "-E", "vmx|svm", "/proc/cpuinfo"], capture_output=True, quiet_stderr=True)
-        if cpuinfo:
+        flags = set(cpuinfo().get(b'flags', b'').split())
+        if b'vmx' in flags or b'svm' in flags:
             print("Virtualization support detected.")
             return True
         else:
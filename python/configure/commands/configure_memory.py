@@ -1,9 +1,14 @@
 import os
+import re
 import subprocess
 import sys
 from typing import Dict, Any
 from .cmd import BaseCmd
-from .utils import run, add_mp_to_fstab
+from .utils import accepting_defaults, cpuinfo, meminfo, mounted_paths, run, add_mp_to_fstab, text_prompt, yes_no_prompt
+
+__all__ = ["ConfigureMemoryCmd"]
+
+NR_HUGEPAGES_1G = "/sys/kernel/mm/hugepages/hugepages-1048576kB/nr_hugepages"
 
 def run_command(command):
     shell = isinstance(command, str)
@@ -18,35 +23,27 @@ def run_command(command):
         sys.exit(1)
 
 
-def run_command_old(command, shell=False):
+def get_hugepage_info():
     """
-    Runs a shell command and returns the output.
-    Exits the script if the command fails.
+    Reads and returns the huge page information from /proc/meminfo.
     """
-    try:
-        print(f"Running command: {command}")
-        if shell:
-            result = subprocess.run(command, check=True, text=True, capture_output=True, shell=True)
-        else:
-            result = subprocess.run(command.split(), check=True, text=True, capture_output=True)
-        print(f"Command '{command}' succeeded.")
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print(f"Error running command: '{command}'")
-        print(f"Return code: {e.returncode}")
-        print(f"STDOUT: {e.stdout}")
-        print(f"STDERR: {e.stderr}")
-        sys.exit(1)
+    print("\n--- Checking Huge Page Support ---")
+    info = {key.decode(): value.decode() for key, value in meminfo().items() if b'huge' in key.lower()}
+    for key, value in info.items():
+        print(f"{key}: {value}")
+    return info
 
 
-def get_hugepage_info():
+def get_total_ram_gb() -> int:
     """
-    Reads and returns the huge page information from /proc/meminfo.
+    Returns the total system RAM in whole GB, like 'free -g' does.
     """
-    print("\n--- Checking Huge Page Support ---")
-    output = run_command("grep -i huge /proc/meminfo")
-    print(output)
-    return {line.split(":")[0].strip(): line.split(":")[1].strip() for line in output.split('\n')}
+    total_bytes = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    if total_bytes > 0:
+        return total_bytes // 1024**3
+
+    # sysconf reports -1 if the value is unavailable, so fall back to /proc/meminfo
+    return int(meminfo()[b'MemTotal'].split()[0]) // 1024**2
 
 
 def allocate_hugepages(num_hugepages):
@@ -54,41 +51,60 @@ def allocate_hugepages(num_hugepages):
     Allocates the specified number of 1GB huge pages.
     """
     print(f"\n--- Allocating {num_hugepages} Huge Pages ---")
+    try:
+        with open(NR_HUGEPAGES_1G) as f:
+            current = int(f.read())
+    except (OSError, ValueError):
+        current = None
+    # Rewriting the same value makes the kernel walk the pools again, which can stall on large hosts
+    if current == num_hugepages:
+        print(f"{num_hugepages} huge pages are already allocated.")
+        return
+
     # Write directly to sysfs to allocate hugepages
-    command = f'echo {num_hugepages} | tee /sys/kernel/mm/hugepages/hugepages-1048576kB/nr_hugepages'
     try:
-        run(command, check=True, shell=True)
+        with open(NR_HUGEPAGES_1G, 'w') as f:
+            f.write(str(num_hugepages))
+        # The huge page counters in /proc/meminfo have changed
+        meminfo.cache_clear()
         print(f"Successfully allocated {num_hugepages} huge pages.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error allocating huge pages. Return code: {e.returncode}")
-        print(f"STDERR: {e.stderr}")
+    except OSError as e:
+        print(f"Error allocating huge pages: {e}")
         print("Please check if you have enough free memory or try a smaller number.")
         raise e
 
 
-def add_hugepages_to_grub_options(grub_options: Dict[str, Any], num_hugepages, enable_5level_paging=False) -> Dict[str, Any]:
-    opt = grub_options.get('GRUB_CMDLINE_LINUX', '')
-    cmdline_linux_options = opt.split() if isinstance(opt, str) else opt
-    opt = grub_options.get('GRUB_CMDLINE_LINUX_DEFAULT', '')
-    cmdline_linux_default_options = opt.split() if isinstance(opt, str) else opt
+HUGEPAGE_OPTION_RE = re.compile(r'(?<!\S)(?:default_hugepagesz|hugepagesz|hugepages)\S*')
+LA57_OPTION_RE = re.compile(r'(?<!\S)la57(?!\S)')
+
+def remove_hugepage_options(opt) -> str:
+    """
+    Returns the kernel command line without any hugepage options, with whitespace normalized.
+    """
+    opt = ' '.join(opt) if isinstance(opt, list) else opt
+    # Most command lines have no hugepage options, so skip the regex for them
+    if 'hugepage' in opt:
+        opt = HUGEPAGE_OPTION_RE.sub('', opt)
+    return ' '.join(opt.split())
 
+
+def add_hugepages_to_grub_options(grub_options: Dict[str, Any], num_hugepages, enable_5level_paging=False) -> Dict[str, Any]:
     # Remove any existing hugepage configuration from both GRUB_CMDLINE_LINUX and GRUB_CMDLINE_LINUX_DEFAULT
-    cmdline_linux_options = [opt for opt in cmdline_linux_options if not opt.startswith(('default_hugepagesz', 'hugepagesz', 'hugepages'))]
-    cmdline_linux_default_options = [opt for opt in cmdline_linux_default_options if not opt.startswith(('default_hugepagesz', 'hugepagesz', 'hugepages'))]
+    cmdline_linux = remove_hugepage_options(grub_options.get('GRUB_CMDLINE_LINUX', ''))
+    cmdline_linux_default = remove_hugepage_options(grub_options.get('GRUB_CMDLINE_LINUX_DEFAULT', ''))
+
+    if enable_5level_paging:
+        # Drop any existing la57 option so that it is only added once below
+        cmdline_linux_default = ' '.join(LA57_OPTION_RE.sub('', cmdline_linux_default).split())
 
     # Add the new hugepage configuration to GRUB_CMDLINE_LINUX_DEFAULT (not GRUB_CMDLINE_LINUX)
     # This ensures it's applied to normal boot entries on Ubuntu
-    cmdline_linux_default_options.append(f'default_hugepagesz=1G')
-    cmdline_linux_default_options.append(f'hugepagesz=1G')
-    cmdline_linux_default_options.append(f'hugepages={num_hugepages}')
-
+    new_options = f'default_hugepagesz=1G hugepagesz=1G hugepages={num_hugepages}'
     if enable_5level_paging:
-        cmdline_linux_default_options = [opt for opt in cmdline_linux_default_options if opt != 'la57']
-        # Add the new la57 option
-        cmdline_linux_default_options.append('la57')
+        new_options += ' la57'
 
-    grub_options['GRUB_CMDLINE_LINUX_DEFAULT'] = ' '.join(cmdline_linux_default_options)
-    grub_options['GRUB_CMDLINE_LINUX'] = ' '.join(cmdline_linux_options)
+    grub_options['GRUB_CMDLINE_LINUX_DEFAULT'] = f'{cmdline_linux_default} {new_options}'.lstrip()
+    grub_options['GRUB_CMDLINE_LINUX'] = cmdline_linux
     return grub_options
 
 
@@ -99,15 +115,14 @@ def supports_5level_paging():
     """
     print("\n--- Checking for 5-level Paging Support ---")
     try:
-        output = run_command('lscpu | grep "Address sizes"')
-        if "57 bits virtual" in output:
+        if b'57 bits virtual' in cpuinfo().get(b'address sizes', b''):
             print("CPU supports 57-bit address space (5-level paging).")
             # We will handle the GRUB update in the main function
             return True
         else:
             print("CPU does not support 57-bit virtual address space. Skipping 5-level paging configuration.")
             return False
-    except subprocess.CalledProcessError:
+    except OSError:
         print("Could not check for 5-level paging support. Skipping.")
         return False
 
@@ -118,10 +133,17 @@ def mount_hugepage_table():
     """
     print("\n--- Mounting Huge Page Table ---")
     mount_point = "/mnt/hugepages-1G"
-    run_command(f"mkdir -p {mount_point}")
-    run_command(f"mount -t hugetlbfs -o pagesize=1G none {mount_point}")
+    os.makedirs(mount_point, exist_ok=True)
+    if mount_point in mounted_paths():
+        print(f"{mount_point} is already mounted.")
+        return mount_point
+
+    run_command(["mount", "-t", "hugetlbfs", "-o", "pagesize=1G", "none", mount_point])
+    mounted_paths.cache_clear()
     print("Verifying mount point...")
-    run_command("grep hugetlbfs /proc/mounts")
+    if mount_point not in mounted_paths():
+        print(f"Error: {mount_point} is not mounted.")
+        sys.exit(1)
     return mount_point
 
 
@@ -151,7 +173,7 @@ def configure_memory(existing_options: Dict[str, Any]):
 
     # 2. Allocate Huge Pages
     try:
-        total_ram_gb = int(run_command("free -g | grep Mem | awk '{print $2}'"))
+        total_ram_gb = get_total_ram_gb()
         print(f"\nTotal system RAM detected: {total_ram_gb} GB.")
     except Exception:
         total_ram_gb = 0
@@ -165,11 +187,28 @@ def configure_memory(existing_options: Dict[str, Any]):
     recommended_vm_memory = total_ram_gb * 0.8
     recommended_buffer = total_ram_gb * 0.05
 
+    default_answer = f"{int(recommended_vm_memory)},{int(recommended_buffer)}"
+    # Workflows can provide the sizes in their environment to skip the prompt
+    preset_answer = None
+    if 'vm_memory_gb' in existing_options and 'buffer_gb' in existing_options:
+        preset_answer = f"{existing_options['vm_memory_gb']},{existing_options['buffer_gb']}"
+
+    default_tried = False
     while True:
         try:
-            vm_memory_gb = int(input(f"\nEnter the total memory you want to dedicate to VMs (in GB) [{recommended_vm_memory}]: ") or recommended_vm_memory)
-            print(f"You entered: {vm_memory_gb}")
-            buffer_gb = int(input(f"Enter the buffer size (in GB) [{recommended_buffer}]: ") or recommended_buffer)
+            if preset_answer:
+                # Only used once, invalid values fall back to the prompt
+                answer, preset_answer = preset_answer, None
+                print(f"\nUsing memory sizes from the workflow environment: {answer}")
+            else:
+                if default_tried and accepting_defaults():
+                    # The default would be used again, nobody can enter a different value
+                    raise RuntimeError("The default memory sizes cannot be used, run interactively to enter them.")
+                default_tried = True
+                answer = text_prompt(f"\nEnter the memory to dedicate to VMs and the buffer size, in GB [{default_answer}]: ",
+                                     default_answer)
+            vm_memory_gb, buffer_gb = (int(value) for value in answer.split(','))
+            print(f"You entered: {vm_memory_gb} GB for VMs, {buffer_gb} GB buffer")
 
             if vm_memory_gb + buffer_gb > total_ram_gb:
                 print("Error: The requested memory exceeds total system RAM. Please enter a smaller value.")
@@ -203,8 +242,7 @@ def configure_memory(existing_options: Dict[str, Any]):
     # 3. Make Huge Pages Persistent
     enable_5level = False
     if supports_5level_paging():
-        print("\nDo you want to enable 5-level paging? (Y/n)")
-        if (input() or 'y').lower() == 'y':
+        if yes_no_prompt("\nDo you want to enable 5-level paging?", True):
             print("5-level paging will be enabled.")
             enable_5level = True
 
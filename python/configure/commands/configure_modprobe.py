@@ -1,28 +1,63 @@
 import os
 from typing import Any, Dict
 from .cmd import BaseCmd
+from .utils import atomic_write_bytes, file_matches
 
-def create_vfio_conf():
+__all__ = [
+    "CreateNvidiaNoDrmConfCmd",
+    "CreateVfioConfCmd",
+]
+
+MODPROBE_DIR = '/etc/modprobe.d/'
+
+_modprobe_dir_ready = False
+
+VFIO_CONF_CONTENT = b"options vfio-pci disable_idle_d3=1\n"
+
+NVIDIA_NO_DRM_CONF_CONTENT = b"""\
+# Prevents NVIDIA DRM/modeset modules from loading on the host,
+# allowing the GPU to be cleanly passed through to a VM
+blacklist nvidia_drm
+blacklist nvidia_modeset
+install nvidia_drm /bin/false
+install nvidia_modeset /bin/false
+"""
+
+def _write_modprobe(name, content: bytes) -> bool:
     """
-    Creates or updates /etc/modprobe.d/99-cloudrift-vfio.conf to disable PCIe power management.
+    Atomically writes a file in /etc/modprobe.d unless it already has the given content.
+    Returns True if the file was written.
     """
-    conf_dir = '/etc/modprobe.d/'
-    conf_file = os.path.join(conf_dir, '99-cloudrift-vfio.conf')
-    option_line = "options vfio-pci disable_idle_d3=1\n"
+    global _modprobe_dir_ready
+    if not _modprobe_dir_ready:
+        os.makedirs(MODPROBE_DIR, exist_ok=True)
+        _modprobe_dir_ready = True
 
-    if not os.path.exists(conf_dir):
-        os.makedirs(conf_dir)
+    conf_file = os.path.join(MODPROBE_DIR, name)
+    if file_matches(conf_file, content):
+        print(f"{conf_file} is already up to date.")
+        return False
 
     try:
-        with open(conf_file, 'w') as f:
-            f.write(option_line)
-        print(f"Created/updated {conf_file} to disable power management for VFIO devices.")
+        atomic_write_bytes(conf_file, content)
+        print(f"Created/updated {conf_file}.")
+        return True
     except IOError as e:
         print(f"Error writing to {conf_file}: {e}")
+        return False
+
+def create_vfio_conf():
+    """
+    Creates or updates /etc/modprobe.d/99-cloudrift-vfio.conf to disable PCIe power management.
+    """
+    if _write_modprobe('99-cloudrift-vfio.conf', VFIO_CONF_CONTENT):
+        print("Disabled power management for VFIO devices.")
 
 class CreateVfioConfCmd(BaseCmd):
     """ Command to create or update vfio.conf. """
 
+    parallel_safe = True
+
     def name(self) -> str:
         return "Create VFIO Modprobe Config"
 
@@ -45,31 +80,15 @@ def create_nvidia_no_drm_conf():
     NVIDIA driver is designed so that if a container uses one GPU, all GPUs are locked and cannot be unbound.
     Blacklisting these modules fixes the problem.
     """
-    conf_dir = '/etc/modprobe.d/'
-    conf_file = os.path.join(conf_dir, '99-cloudrift-nvidia-no-drm.conf')
-    content = """\
-# Prevents NVIDIA DRM/modeset modules from loading on the host,
-# allowing the GPU to be cleanly passed through to a VM
-blacklist nvidia_drm
-blacklist nvidia_modeset
-install nvidia_drm /bin/false
-install nvidia_modeset /bin/false
-"""
-
-    if not os.path.exists(conf_dir):
-        os.makedirs(conf_dir)
-
-    try:
-        with open(conf_file, 'w') as f:
-            f.write(content)
-        print(f"Created/updated {conf_file} to block NVIDIA DRM modules.")
-    except IOError as e:
-        print(f"Error writing to {conf_file}: {e}")
+    if _write_modprobe('99-cloudrift-nvidia-no-drm.conf', NVIDIA_NO_DRM_CONF_CONTENT):
+        print("Blocked NVIDIA DRM modules.")
 
 
 class CreateNvidiaNoDrmConfCmd(BaseCmd):
     """ Command to create 99-cloudrift-nvidia-no-drm.conf to block NVIDIA DRM modules. """
 
+    parallel_safe = True
+
     def name(self) -> str:
         return "Create NVIDIA No-DRM Modprobe Config"
 
@@ -1,35 +1,69 @@
 
+import functools
+import glob
 import subprocess
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict
 from .cmd import BaseCmd
-from .utils import numbered_prompt, run, reboot_prompt, yes_no_prompt
+from .utils import APT_INSTALL_ENV, accepting_defaults, apt_install, apt_search, atomic_write_bytes, ensure_apt_updated, fetch_url, file_matches, natural_sort_key, numbered_prompt, preset_choice, run, reboot_prompt, schedule_restart, yes_no_prompt
+
+__all__ = [
+    "InstallNvidiaContainerToolkitCmd",
+    "InstallNvidiaCudaToolkitCmd",
+    "InstallNvidiaDriverCmd",
+    "RemoveNvidiaDriverCmd",
+]
+
+# Anchored so apt_search does the prefix filtering in a single pass
+NVIDIA_DRIVER_PACKAGE_PATTERN = r"^nvidia-driver-"
+CUDA_TOOLKIT_PACKAGE_PATTERN = r"^(nvidia-cuda-toolkit|cuda-toolkit-)"
+NVIDIA_CONTAINER_TOOLKIT_GPG_KEY_URL = "https://nvidia.github.io/libnvidia-container/gpgkey"
+NVIDIA_CONTAINER_TOOLKIT_LIST_URL = "https://nvidia.github.io/libnvidia-container/stable/deb/nvidia-container-toolkit.list"
+NVIDIA_CONTAINER_TOOLKIT_KEYRING = "/usr/share/keyrings/nvidia-container-toolkit-keyring.gpg"
+NVIDIA_CONTAINER_TOOLKIT_LIST = "/etc/apt/sources.list.d/nvidia-container-toolkit.list"
 
 def check_nvidia():
     """
     Check if nvidia driver is installed
     """
     
-    output, _, return_code = run("lsmod | grep nvidia", shell=True, capture_output=True, check=False)
-    if return_code == 0 and output:
+    try:
+        with open("/proc/modules") as f:
+            # The first field is the module name: nvidia, nvidia_drm, nvidia_uvm, ...
+            loaded = any(line.startswith(("nvidia ", "nvidia_")) for line in f)
+    except OSError:
+        loaded = False
+
+    if loaded:
         print("NVIDIA driver is in use.")
     else:
         print("NVIDIA driver is not in use.")
     
-    return return_code == 0 and output
+    return loaded
 
+@functools.lru_cache(maxsize=1)
 def check_nvidia_installed():
     """
     Check if nvidia driver is installed
     """
     
     output, _, return_code = run("nvidia-smi", shell=True, capture_output=True, check=False)
-    if return_code == 0 and output:
+    installed = return_code == 0 and bool(output)
+    if installed:
         print("NVIDIA driver is installed.")
     else:
         print("NVIDIA driver is not installed.")
     
-    return return_code == 0 and output
+    return installed
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+            print(f"Removed {path}")
+        except FileNotFoundError:
+            pass
 
 def remove_nvidia_driver():
     """
@@ -48,8 +82,9 @@ def remove_nvidia_driver():
 
         # Remove NVIDIA driver and associated packages
         print("Removing NVIDIA packages...")
-        run(["apt-get", "remove", "--purge", "^nvidia-.*"])
-        run(["apt-get", "autoremove"])
+        # Nothing asked the user before this purge, so apt confirms it unless the run accepts defaults
+        assume_yes = ["-y"] if accepting_defaults() else []
+        run(["apt-get", "remove", *assume_yes, "--purge", "--autoremove", "^nvidia-.*"], env=APT_INSTALL_ENV)
 
         # Blacklist the nouveau driver
         print("Adding 'nouveau' to /etc/modules...")
@@ -58,14 +93,13 @@ def remove_nvidia_driver():
 
         # Clean up X11 configuration
         print("Removing X11 configuration files...")
-        #run(["rm", "/etc/X11/xorg.conf"])
-        run(["rm", "-rf", "/etc/X11/xorg.conf"])
+        remove_files(["/etc/X11/xorg.conf"])
 
         # Clean up modprobe configurations
         print("Removing modprobe configuration files...")
-        run(["rm", "-rf", "/etc/modprobe.d/nvidia*.conf"])
-        run(["rm", "-rf", "/lib/modprobe.d/nvidia*.conf"])
+        remove_files(glob.glob("/etc/modprobe.d/nvidia*.conf") + glob.glob("/lib/modprobe.d/nvidia*.conf"))
 
+        check_nvidia_installed.cache_clear()
         reboot_prompt()
     else:
         print("NVIDIA driver does not appear to be in use, or the command failed to run.")
@@ -75,53 +109,44 @@ def find_nvidia_driver() -> list[str]:
     Find available NVIDIA drivers from the package repository.
     """
     try:
-        # Search for nvidia driver packages
-        output, _, return_code = run(
-            ["apt", "search", "nvidia-driver"], 
-            shell=False, 
-            capture_output=True, 
-            check=False
-        )
-        
-        if return_code != 0:
-            return []
-        
-        drivers = []
-        for line in output.split('\n'):
-            if 'nvidia-driver-' in line and line.startswith('nvidia-driver-'):
-                # Extract driver package name
-                package_name = line.split('/')[0].strip()
-                if package_name not in drivers:
-                    drivers.append(package_name)
-        
-        return sorted(drivers)
-        
+        return sorted(set(apt_search(NVIDIA_DRIVER_PACKAGE_PATTERN)), key=natural_sort_key)
     except Exception as e:
         print(f"Error finding NVIDIA drivers: {e}")
-        return []    
-    return []
+        return []
 
-def install_nvidia_driver():
+def install_nvidia_driver(reinstall=False) -> bool:
     """
     Install the NVIDIA driver.
     """
 
-    if yes_no_prompt("Do you want to purge existing NVIDIA drivers before installation?", True):
-        print("Removing any existing NVIDIA drivers...")
-        run(["apt-get", "remove", "--purge", "^nvidia-.*"])
-
+    # Pick the driver first, so nothing is purged when no driver will be installed
     drivers = find_nvidia_driver()
 
-    for idx, driver in enumerate(drivers):
-        print(f"{idx + 1}. {driver}")
-    choice = numbered_prompt("Select the NVIDIA driver to install:", 1, len(drivers))
-    if choice is None:
-        print("No driver selected, aborting installation.")
-        return
+    driver = preset_choice('nvidia-driver')
+    if driver is None:
+        for idx, name in enumerate(drivers):
+            print(f"{idx + 1}. {name}")
+        choice = numbered_prompt("Select the NVIDIA driver to install:", 1, len(drivers))
+        if choice is None:
+            if accepting_defaults():
+                print("No driver given with --nvidia-driver, skipping the driver installation.")
+            else:
+                print("No driver selected, aborting installation.")
+            return True
+        driver = drivers[choice - 1]
+    elif driver not in drivers:
+        print(f"NVIDIA driver {driver} is not available. Available drivers: {', '.join(drivers)}")
+        return False
+
+    if yes_no_prompt("Do you want to purge existing NVIDIA drivers before installation?", True):
+        print("Removing any existing NVIDIA drivers...")
+        run(["apt-get", "remove", "-y", "--purge", "^nvidia-.*"], env=APT_INSTALL_ENV)
 
-    print(f"Installing NVIDIA driver {drivers[choice - 1]}...")
-    run(["apt-get", "install", "-y", drivers[choice - 1]])
+    print(f"Installing NVIDIA driver {driver}...")
+    apt_install([driver], reinstall=reinstall)
+    check_nvidia_installed.cache_clear()
     reboot_prompt()
+    return True
 
 def configure_container_toolkit_repository() -> bool:
     """
@@ -130,18 +155,25 @@ def configure_container_toolkit_repository() -> bool:
     try:
         print("Configuring NVIDIA Container Toolkit repository...")
 
-        print("Downloading and installing NVIDIA GPG key...")
-        run("curl -fsSL https://nvidia.github.io/libnvidia-container/gpgkey | gpg -o /usr/share/keyrings/nvidia-container-toolkit-keyring.gpg",
-            shell=True, check=True)
+        # The key and the list are independent downloads, fetch them concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            key_future = executor.submit(fetch_url, NVIDIA_CONTAINER_TOOLKIT_GPG_KEY_URL)
+            list_future = executor.submit(fetch_url, NVIDIA_CONTAINER_TOOLKIT_LIST_URL)
+            key, repo_list = key_future.result(), list_future.result()
+
+        print("Installing NVIDIA GPG key...")
+        subprocess.run(["gpg", "--dearmor", "--yes", "-o", NVIDIA_CONTAINER_TOOLKIT_KEYRING], input=key, check=True)
 
         print("Adding NVIDIA Container Toolkit repository...")
-        tmp_repo_path = "/tmp/nvidia-container-toolkit.list"
-        run(["curl", "-sL", "https://nvidia.github.io/libnvidia-container/stable/deb/nvidia-container-toolkit.list", "-o", tmp_repo_path], check=True)
-        run(["sed", "-i", "s#deb https://#deb [signed-by=/usr/share/keyrings/nvidia-container-toolkit-keyring.gpg] https://#g", tmp_repo_path], check=True)
-        run(["mv", tmp_repo_path, "/etc/apt/sources.list.d/nvidia-container-toolkit.list"], check=True)
+        repo_list = repo_list.replace(
+            b"deb https://", f"deb [signed-by={NVIDIA_CONTAINER_TOOLKIT_KEYRING}] https://".encode())
+        repo_changed = not file_matches(NVIDIA_CONTAINER_TOOLKIT_LIST, repo_list)
+        if repo_changed:
+            atomic_write_bytes(NVIDIA_CONTAINER_TOOLKIT_LIST, repo_list)
 
+        # The lists only need a forced refresh when the repository was added or changed
         print("Updating package lists...")
-        run(["apt-get", "update"], check=True)
+        ensure_apt_updated(force=repo_changed, source_list=NVIDIA_CONTAINER_TOOLKIT_LIST)
 
         print("NVIDIA Container Toolkit repository configured successfully.")
     except Exception as e:
@@ -149,6 +181,7 @@ def configure_container_toolkit_repository() -> bool:
         return False
     return True
 
+@functools.lru_cache(maxsize=1)
 def check_nvidia_container_toolkit_installed() -> bool:
     """
     Check if NVIDIA Container Toolkit is installed.
@@ -188,7 +221,8 @@ def install_nvidia_container_toolkit() -> bool:
     Install NVIDIA Container Toolkit if not already installed.
     """
     # Check if already installed
-    if check_nvidia_container_toolkit_installed():
+    reinstall = check_nvidia_container_toolkit_installed()
+    if reinstall:
         if not yes_no_prompt("NVIDIA Container Toolkit is already installed. Do you want to reinstall it?", False):
             return True
     
@@ -198,13 +232,14 @@ def install_nvidia_container_toolkit() -> bool:
 
     try:
         print("Installing NVIDIA Container Toolkit...")
-        run(["apt-get", "install", "-y", "nvidia-container-toolkit"])
+        apt_install(["nvidia-container-toolkit"], recommends=False, reinstall=reinstall)
         
         print("Configuring Docker runtime...")
+        check_nvidia_container_toolkit_installed.cache_clear()
         run(["nvidia-ctk", "runtime", "configure", "--runtime=docker"])
         
-        print("Restarting Docker service...")
-        run(["systemctl", "restart", "docker"])
+        print("Scheduling Docker service restart...")
+        schedule_restart("docker")
         
         print("NVIDIA Container Toolkit installation completed successfully.")
         return True
@@ -217,36 +252,15 @@ def find_cuda_versions() -> list[str]:
     Find available CUDA Toolkit versions from the package repository.
     """
     try:
-        # Search for cuda toolkit packages
-        output, _, return_code = run(
-            ["apt", "search", "cuda-toolkit"],
-            shell=False,
-            capture_output=True,
-            check=False
-        )
-
-        if return_code != 0:
-            return []
-
-        versions = []
-        for line in output.split('\n'):
-            # Match both patterns: nvidia-cuda-toolkit and cuda-toolkit-
-            # nvidia-cuda-toolkit is the main package in Ubuntu repos
-            # cuda-toolkit-XX-Y are version-specific packages from NVIDIA repos
-            if ('nvidia-cuda-toolkit' in line and line.startswith('nvidia-cuda-toolkit')) or \
-               ('cuda-toolkit-' in line and line.startswith('cuda-toolkit-')):
-                # Extract package name (before the '/' separator)
-                package_name = line.split('/')[0].strip()
-                if package_name not in versions:
-                    versions.append(package_name)
-
-        return sorted(versions)
-
+        # Match both patterns: nvidia-cuda-toolkit and cuda-toolkit-
+        # nvidia-cuda-toolkit is the main package in Ubuntu repos
+        # cuda-toolkit-XX-Y are version-specific packages from NVIDIA repos
+        return sorted(set(apt_search(CUDA_TOOLKIT_PACKAGE_PATTERN)), key=natural_sort_key)
     except Exception as e:
         print(f"Error finding CUDA Toolkit versions: {e}")
         return []
-    return []
 
+@functools.lru_cache(maxsize=1)
 def check_cuda_installed() -> bool:
     """
     Check if CUDA Toolkit is installed.
@@ -268,7 +282,7 @@ def check_cuda_installed() -> bool:
         print(f"Error checking CUDA Toolkit installation: {e}")
         return False
 
-def install_nvidia_cuda_toolkit() -> bool:
+def install_nvidia_cuda_toolkit(reinstall=False) -> bool:
     """
     Install NVIDIA CUDA Toolkit.
     """
@@ -278,19 +292,30 @@ def install_nvidia_cuda_toolkit() -> bool:
             print("No CUDA Toolkit versions found in the repository.")
             return False
 
-        for idx, package in enumerate(cuda_packages):
-            print(f"{idx + 1}. {package}")
-        print("CUDA Toolkit Driver Version Ranges:")
-        print("  cuda-toolkit-13: Driver >= 580")
-        print("  cuda-toolkit-12: Driver >= 525")
-        print("  cuda-toolkit-11: Driver >= 450")
-        choice = numbered_prompt("Select the CUDA Toolkit package to install:", 1, len(cuda_packages))
-        if choice is None:
-            print("No package selected, aborting installation.")
+        package = preset_choice('cuda-package')
+        if package is None:
+            for idx, name in enumerate(cuda_packages):
+                print(f"{idx + 1}. {name}")
+            print("CUDA Toolkit Driver Version Ranges:")
+            print("  cuda-toolkit-13: Driver >= 580")
+            print("  cuda-toolkit-12: Driver >= 525")
+            print("  cuda-toolkit-11: Driver >= 450")
+            choice = numbered_prompt("Select the CUDA Toolkit package to install:", 1, len(cuda_packages))
+            if choice is None:
+                if accepting_defaults():
+                    # Unattended runs without a package choice leave CUDA out instead of failing
+                    print("No package given with --cuda-package, skipping the CUDA Toolkit installation.")
+                    return True
+                print("No package selected, aborting installation.")
+                return False
+            package = cuda_packages[choice - 1]
+        elif package not in cuda_packages:
+            print(f"CUDA Toolkit package {package} is not available. Available packages: {', '.join(cuda_packages)}")
             return False
 
-        print(f"Installing NVIDIA CUDA Toolkit {cuda_packages[choice - 1]}")
-        run(["apt-get", "install", "-y", cuda_packages[choice - 1]])
+        print(f"Installing NVIDIA CUDA Toolkit {package}")
+        apt_install([package], recommends=False, reinstall=reinstall)
+        check_cuda_installed.cache_clear()
 
         print("NVIDIA CUDA Toolkit installation completed successfully.")
         return True
@@ -322,12 +347,12 @@ class InstallNvidiaDriverCmd(BaseCmd):
         return "Checks for and installs NVIDIA drivers if they are not installed."
 
     def execute(self, env: Dict[str, Any]) -> bool:
-        if check_nvidia_installed():
+        reinstall = check_nvidia_installed()
+        if reinstall:
             if not yes_no_prompt("NVIDIA driver is already installed. Do you want to reinstall it?", False):
                 return True
         
-        install_nvidia_driver()
-        return True
+        return install_nvidia_driver(reinstall=reinstall)
 
 class InstallNvidiaContainerToolkitCmd(BaseCmd):
     """ Command to install NVIDIA Container Toolkit. """
@@ -359,8 +384,9 @@ class InstallNvidiaCudaToolkitCmd(BaseCmd):
             print("NVIDIA driver is not installed. Please install the driver first.")
             return False
 
-        if check_cuda_installed():
+        cuda_installed = check_cuda_installed()
+        if cuda_installed:
             if not yes_no_prompt("NVIDIA CUDA Toolkit is already installed. Do you want to reinstall it?", False):
                 return True
 
-        return install_nvidia_cuda_toolkit()
\ No newline at end of file
+        return install_nvidia_cuda_toolkit(reinstall=cuda_installed)
\ No newline at end of file
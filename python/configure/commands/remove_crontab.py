@@ -3,6 +3,10 @@ from typing import Any, Dict
 from .cmd import BaseCmd
 from .utils import run
 
+__all__ = ["RemoveCrontabCmd"]
+
+ROOT_CRONTAB_FILE = "/var/spool/cron/crontabs/root"
+
 
 class RemoveCrontabCmd(BaseCmd):
     """Command to remove the root crontab."""
@@ -15,20 +19,17 @@ class RemoveCrontabCmd(BaseCmd):
 
     def execute(self, env: Dict[str, Any]) -> bool:
         try:
-            # Check if there's an existing crontab
-            result = subprocess.run(
-                ["crontab", "-l"],
-                capture_output=True,
-                text=True
-            )
-
-            if result.returncode != 0:
+            # Read the spool file directly instead of running 'crontab -l'
+            try:
+                with open(ROOT_CRONTAB_FILE, 'r') as f:
+                    entries = f.read()
+            except FileNotFoundError:
                 print("No crontab found for root user. Nothing to remove.")
                 return True
 
             # Show existing crontab before removal
             print("Current crontab entries:")
-            print(result.stdout)
+            print(entries)
 
             # Remove the crontab
             print("Removing root crontab...")
@@ -1,13 +1,59 @@
 
+import functools
+import glob
+import gzip
+import lzma
+import os
+import platform
+import re
+import shutil
 import subprocess
+import time
+import urllib.request
 
 CLOUDRIFT_MEDIA_MOUNT = '/media/cloudrift'
+PCI_DEVICES_DIR = '/sys/bus/pci/devices'
+NVIDIA_PCI_VENDOR = '0x10de'
+APT_LISTS_DIR = '/var/lib/apt/lists'
+FSTAB_PATH = '/etc/fstab'
 
-def run(cmd, check=True, capture_output=False, quiet_stderr=False, shell=False):
+_OCTAL_ESCAPE_RE = re.compile(r'\\([0-7]{3})')
+_DIGITS_RE = re.compile(r'(\d+)')
+APT_PACKAGE_NAME_RE = re.compile(rb'^Package: (\S+)', re.MULTILINE)
+# Compression suffix of apt list files -> opener
+APT_LIST_OPENERS = {'': open, '.gz': gzip.open, '.xz': lzma.open}
+APT_LIST_CHUNK_SIZE = 1 << 20
+
+# Keeps apt-get from blocking on debconf or config file prompts
+APT_INSTALL_ENV = {"DEBIAN_FRONTEND": "noninteractive"}
+APT_INSTALL_OPTIONS = ["-o", "Dpkg::Options::=--force-confdef", "-o", "Dpkg::Options::=--force-confold",
+                       "-o", "Dpkg::Use-Pty=0"]
+
+_apt_updated = False
+_pending_restarts: set[str] = set()
+# Set from the command line, see set_prompt_mode()
+_accept_defaults = False
+_skip_reboot = False
+_preset_choices: dict[str, str] = {}
+# Name -> command that regenerates boot files, see schedule_boot_update()
+_pending_boot_updates: dict[str, list[str]] = {}
+
+def run(cmd, check=True, capture_output=False, quiet_stderr=False, shell=False, env=None, quiet_stdout=False):
     kwargs = {}
+    if env:
+        kwargs["env"] = {**os.environ, **env}
     if capture_output:
         kwargs["stdout"] = subprocess.PIPE
         kwargs["text"] = True
+    elif quiet_stdout:
+        kwargs["stdout"] = subprocess.DEVNULL
+    if not shell and isinstance(cmd, list):
+        # With a resolved path and close_fds=False subprocess uses posix_spawn instead of
+        # fork+exec. Descriptors opened by Python are non-inheritable, so none leak to the child.
+        executable = _which(cmd[0])
+        if executable:
+            kwargs["executable"] = executable
+            kwargs["close_fds"] = False
     if quiet_stderr:
         kwargs["stderr"] = subprocess.DEVNULL
     print(f"Running command: {' '.join(cmd) if isinstance(cmd, list) else cmd}")
@@ -15,15 +61,180 @@ def run(cmd, check=True, capture_output=False, quiet_stderr=False, shell=False):
     stdout = result.stdout.strip() if capture_output and result.stdout else ""
     return stdout, result.stderr if quiet_stderr else None, result.returncode
 
+_which_cache: dict[str, str] = {}
+
+def _which(name):
+    # Only found paths are cached, a tool installed later in the run is still picked up
+    path = _which_cache.get(name)
+    if path is None:
+        path = shutil.which(name)
+        if path is not None:
+            _which_cache[name] = path
+    return path
+
+def file_matches(path, expected: bytes) -> bool:
+    """
+    Checks whether the file at path holds exactly the expected bytes. The size is
+    compared first so files with different content are usually not read at all.
+    """
+    try:
+        if os.stat(path).st_size != len(expected):
+            return False
+        with open(path, 'rb') as f:
+            return f.read() == expected
+    except FileNotFoundError:
+        return False
+
+def atomic_write_bytes(path, data: bytes):
+    """
+    Replaces the file at path with data. The data is written and fsynced to a temporary file
+    next to it, which is then renamed over the target so a crash never leaves a partial file.
+    The permissions of an existing file are kept.
+    """
+    path = os.fspath(path)
+    tmp_path = path + '.tmp'
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o644
+
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        os.fsync(fd)
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp_path)
+        raise
+    os.close(fd)
+    os.replace(tmp_path, path)
+
+@functools.lru_cache(maxsize=None)
+def mounted_paths() -> frozenset[str]:
+    """
+    Returns the set of current mount points. Call mounted_paths.cache_clear() after mounting.
+    """
+    with open('/proc/self/mountinfo') as f:
+        # Field 5 is the mount point, with spaces and other special characters octal-escaped
+        return frozenset(_OCTAL_ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 8)), line.split()[4]) for line in f)
+
+@functools.lru_cache(maxsize=None)
+def cpuinfo() -> dict[bytes, bytes]:
+    """
+    Returns the fields of the first processor entry in /proc/cpuinfo, e.g. b'vendor_id' and b'flags'.
+    """
+    fields = {}
+    with open('/proc/cpuinfo', 'rb') as f:
+        # Stop at the blank line ending the first entry instead of reading all CPUs
+        for line in f:
+            key, sep, value = line.partition(b':')
+            if sep:
+                fields[key.strip()] = value.strip()
+            elif not line.strip():
+                break
+    return fields
+
+@functools.lru_cache(maxsize=None)
+def meminfo() -> dict[bytes, bytes]:
+    """
+    Returns the fields of /proc/meminfo, e.g. b'MemTotal' -> b'131072 kB'.
+    Call meminfo.cache_clear() after changing the huge page allocation.
+    """
+    fields = {}
+    with open('/proc/meminfo', 'rb') as f:
+        for line in f:
+            key, sep, value = line.partition(b':')
+            if sep:
+                fields[key.strip()] = value.strip()
+    return fields
+
+def require_binaries(names):
+    """
+    Raises RuntimeError if any of the given commands is not available on PATH.
+    """
+    for bin_name in names:
+        if _which(bin_name) is None:
+            raise RuntimeError(f"Missing required command: {bin_name}")
+
+@functools.lru_cache(maxsize=None)
+def nvidia_pci_devices() -> tuple[str, ...]:
+    """
+    Returns the PCI addresses of all NVIDIA devices by reading sysfs directly.
+    The result is cached, as the PCI topology does not change without hotplug.
+    Raises OSError if sysfs is not available.
+    """
+    devices = []
+    with os.scandir(PCI_DEVICES_DIR) as it:
+        for entry in it:
+            try:
+                with open(os.path.join(entry.path, 'vendor')) as f:
+                    vendor = f.read().strip()
+            except OSError:
+                continue
+            if vendor == NVIDIA_PCI_VENDOR:
+                devices.append(entry.name)
+    return tuple(sorted(devices))
+
+def natural_sort_key(name: str) -> tuple:
+    """
+    Sort key that orders embedded numbers numerically, so "cuda-toolkit-12-9" sorts before "cuda-toolkit-12-10".
+    """
+    parts = _DIGITS_RE.split(name)
+    # Text and numbers alternate, so every part is compared against one of the same type
+    return tuple(int(part) if i % 2 else part for i, part in enumerate(parts))
+
+def fetch_url(url, timeout=30) -> bytes:
+    """
+    Downloads the given URL into memory.
+    """
+    print(f"Downloading {url}")
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+def set_prompt_mode(accept_defaults=False, skip_reboot=False, choices=None):
+    """
+    With accept_defaults every prompt is answered with its default instead of reading
+    stdin, so unattended runs never block. skip_reboot suppresses the reboot prompts.
+    choices maps a choice name, e.g. 'nvidia-driver', to the option picked without asking.
+    """
+    global _accept_defaults, _skip_reboot, _preset_choices
+    _accept_defaults = accept_defaults
+    _skip_reboot = skip_reboot
+    _preset_choices = dict(choices or {})
+
+def accepting_defaults() -> bool:
+    return _accept_defaults
+
+def preset_choice(name: str) -> str | None:
+    """
+    Returns the option given on the command line for the named choice, or None.
+    """
+    return _preset_choices.get(name)
+
 def yes_no_prompt(prompt: str, default: bool) -> bool:
     default_input = 'y' if default else 'n'
     default_yes = 'Y' if default else 'y'
     default_no = 'N' if not default else 'n'
     print(f"{prompt} ({default_yes}/{default_no})")
-    return (input() or default_input).lower() == 'y'
+    if _accept_defaults:
+        print(f"Using the default answer: {default_input}")
+        return default
+    return (input().strip() or default_input).lower().startswith('y')
+
+def text_prompt(prompt: str, default: str) -> str:
+    if _accept_defaults:
+        print(f"{prompt}{default}")
+        return default
+    return input(prompt) or default
 
 def numbered_prompt(prompt: str, min_index: int, max_index: int) -> int | None:
     print(prompt)
+    if _accept_defaults:
+        # There is no sensible default among the choices, so nothing is selected
+        print("No selection is made when accepting defaults.")
+        return None
     while True:
         try:
             value = input(f"Enter a number ({min_index}-{max_index}) or <Enter> for exit: ")
@@ -38,38 +249,251 @@ def numbered_prompt(prompt: str, min_index: int, max_index: int) -> int | None:
             print("Invalid input. Please enter a valid number.")
 
 def reboot_prompt():
+    if _skip_reboot:
+        print("Skipping the reboot. Please reboot at your convenience to apply the changes.")
+        return
     if yes_no_prompt("\nReboot now?", False):
-        print("Rebooting...")
-        run(["reboot"])
+        if not flush_boot_updates():
+            # Rebooting now could leave the machine with a broken initramfs or boot menu,
+            # so fail the step like the update command itself would have
+            raise RuntimeError("The boot files could not be regenerated, not rebooting")
+        print("Rebooting...", flush=True)
+        # Nothing runs after a reboot, so replace this process instead of forking a child
+        os.execvp("reboot", ["reboot"])
     else:
         print("Please reboot at your convenience to apply the changes.")
 
-def apt_install(packages):
+def ensure_apt_updated(max_age=300, force=False, source_list=None):
+    """
+    Runs 'apt-get update' unless it already ran in this process or the package
+    lists were refreshed less than max_age seconds ago.
+    Use force=True after adding a new apt source. If source_list names that source and
+    the other lists are current, only the given source is refreshed.
+    """
+    global _apt_updated
+    if _apt_updated and not force:
+        return
+    lists_fresh = _apt_updated
+    if not lists_fresh:
+        try:
+            lists_fresh = time.time() - os.path.getmtime(APT_LISTS_DIR) < max_age
+        except OSError:
+            pass
+    if lists_fresh and not force:
+        print("Apt package lists are up to date, skipping 'apt-get update'.")
+        _apt_updated = True
+        return
+    if lists_fresh and source_list:
+        # List-Cleanup=0 keeps apt from deleting the lists of the sources left out here
+        run(["apt-get", "update", "-o", f"Dir::Etc::sourcelist={source_list}",
+             "-o", "Dir::Etc::sourceparts=-", "-o", "APT::Get::List-Cleanup=0"])
+    else:
+        run(["apt-get", "update"])
+    _apt_updated = True
+    apt_package_names.cache_clear()
+    apt_search.cache_clear()
+
+@functools.lru_cache(maxsize=None)
+def apt_package_names() -> frozenset[str] | None:
+    """
+    Returns the names of all packages in the local apt lists, or None if a list is
+    compressed in a format that cannot be read here.
+    """
+    names = set()
+    for path in glob.glob(os.path.join(APT_LISTS_DIR, '*_Packages*')):
+        suffix = '' if path.endswith('_Packages') else os.path.splitext(path)[1]
+        opener = APT_LIST_OPENERS.get(suffix)
+        if opener is None:
+            return None
+        with opener(path, 'rb') as f:
+            # Lists can be tens of MB, so scan them in chunks cut at line boundaries
+            tail = b''
+            while chunk := f.read(APT_LIST_CHUNK_SIZE):
+                chunk = tail + chunk
+                cut = chunk.rfind(b'\n') + 1
+                names.update(APT_PACKAGE_NAME_RE.findall(chunk, 0, cut))
+                tail = chunk[cut:]
+            names.update(APT_PACKAGE_NAME_RE.findall(tail))
+    return frozenset(name.decode() for name in names)
+
+@functools.lru_cache(maxsize=None)
+def apt_search(pattern) -> tuple[str, ...]:
+    """
+    Returns the names of packages whose name matches the pattern. Reads the apt lists
+    directly and falls back to 'apt-cache search'. Cached until the next
+    ensure_apt_updated() run.
+    """
+    names = apt_package_names()
+    if names is not None:
+        regex = re.compile(pattern)
+        return tuple(sorted(name for name in names if regex.search(name)))
+
+    output, _, return_code = run(["apt-cache", "search", "--names-only", pattern], capture_output=True, check=False)
+    if return_code != 0:
+        return ()
+    # Lines look like "nvidia-driver-550 - NVIDIA driver metapackage"
+    return tuple(line.split(' ', 1)[0] for line in output.splitlines() if line)
+
+def schedule_restart(service):
+    """
+    Queues a systemd service to be restarted by flush_restarts().
+    """
+    _pending_restarts.add(service)
+
+def service_active_since(service) -> float | None:
+    """
+    Returns the wall-clock time at which a systemd service last became active,
+    or None if it is not running.
+    """
+    output, _, rc = run(["systemctl", "show", "--value", "-p", "ActiveEnterTimestampMonotonic", service],
+                        capture_output=True, check=False)
+    if rc != 0 or not output.isdigit() or int(output) == 0:
+        return None
+    # systemd reports CLOCK_MONOTONIC, which is what time.monotonic() reads on Linux
+    return time.time() - (time.monotonic() - int(output) / 1_000_000)
+
+def flush_restarts() -> bool:
+    """
+    Restarts all queued services that are running with one systemctl call and checks
+    that they are active again.
+    """
+    if not _pending_restarts:
+        return True
+
+    services = sorted(_pending_restarts)
+    _pending_restarts.clear()
+
+    # Only running services need a restart. Stopped and socket-activated services pick up
+    # the new configuration when they start, and masked or missing units cannot be restarted.
+    output, _, _ = run(["systemctl", "is-active", *services], capture_output=True, check=False)
+    running = [svc for svc, state in zip(services, output.splitlines()) if state == "active"]
+    for svc in services:
+        if svc not in running:
+            print(f"{svc} is not running; skipping restart.")
+    if not running:
+        return True
+
+    print(f"Restarting services: {', '.join(running)}")
+    _, _, rc = run(["systemctl", "try-restart", *running], check=False)
+    if rc == 0:
+        _, _, rc = run(["systemctl", "is-active", "--quiet", *running], check=False)
+    if rc != 0:
+        print(f"Error: Failed to restart services: {', '.join(running)}")
+        return False
+
+    print("Services are active.")
+    return True
+
+def schedule_boot_update(name, cmd):
+    """
+    Queues a command that regenerates boot files, such as the initramfs or grub.cfg, to be
+    run once by flush_boot_updates() after all configuration files are written.
+    """
+    _pending_boot_updates[name] = cmd
+
+def flush_boot_updates() -> bool:
+    """
+    Runs all queued boot updates one after another. The initramfs is regenerated first,
+    so update-grub sees the final initrd images in /boot.
+    """
+    if not _pending_boot_updates:
+        return True
+
+    names = sorted(_pending_boot_updates, key=lambda name: name != 'initramfs')
+    commands = [_pending_boot_updates[name] for name in names]
+    _pending_boot_updates.clear()
+
+    success = True
+    for cmd in commands:
+        try:
+            _, _, rc = run(cmd, check=False)
+        except OSError as e:
+            print(f"Error: could not run '{' '.join(cmd)}': {e}")
+            success = False
+            continue
+        if rc != 0:
+            print(f"Error: '{' '.join(cmd)}' failed with exit code {rc}")
+            success = False
+    return success
+
+@functools.lru_cache(maxsize=None)
+def get_os_codename() -> str | None:
+    """
+    Returns VERSION_CODENAME from /etc/os-release (e.g. 'noble'), or None if not set.
+    """
+    return platform.freedesktop_os_release().get("VERSION_CODENAME")
+
+# Maps platform.machine() names to Debian architecture names
+DPKG_ARCHITECTURES = {
+    "x86_64": "amd64",
+    "aarch64": "arm64",
+    "armv7l": "armhf",
+    "ppc64le": "ppc64el",
+}
+
+@functools.lru_cache(maxsize=None)
+def dpkg_arch() -> str:
+    """
+    Returns the Debian architecture name of this machine, as 'dpkg --print-architecture' would.
+    """
+    machine = platform.machine()
+    return DPKG_ARCHITECTURES.get(machine, machine)
+
+def get_installed_packages() -> set[str] | None:
+    """
+    Returns the names of all packages dpkg reports as installed, or None if dpkg cannot be queried.
+    """
+    out, _, rc = run(["dpkg-query", "-W", "-f=${db:Status-Status} ${Package}\n"],
+                     check=False, capture_output=True, quiet_stderr=True)
+    if rc != 0:
+        return None
+    return {line.split()[1] for line in out.splitlines() if line.startswith("installed ")}
+
+def apt_install(packages, recommends=True, reinstall=False):
+    # Skip packages that are already installed, and apt entirely if nothing is left
+    installed = None if reinstall else get_installed_packages()
+    if installed is not None:
+        packages = [package for package in packages if package not in installed]
+        if not packages:
+            print("All requested packages are already installed.")
+            return
     print(f"Updating apt and installing packages {packages}...")
-    run(["apt", "update"])
-    run(["apt", "install", "-y", *packages])
+    ensure_apt_updated()
+    cmd = ["apt-get", "install", "-y", *APT_INSTALL_OPTIONS]
+    if not recommends:
+        cmd.append("--no-install-recommends")
+    if reinstall:
+        cmd.append("--reinstall")
+    run([*cmd, *packages], env=APT_INSTALL_ENV)
 
 def add_mp_to_fstab(fstab_line, mount_point) -> bool:
     """
     Adds the mount point to /etc/fstab to persist across reboots.
     """
+    # Compare whitespace separated fields so differences in spacing are not new entries
+    fields = fstab_line.split()
+    line = ''
     try:
         # Check if the line already exists
-        with open("/etc/fstab", 'r') as f:
-            if fstab_line in f.read():
-                print(f"Mount point '{mount_point}' already exists in /etc/fstab.")
-                return True
+        with open(FSTAB_PATH, 'r') as f:
+            for line in f:
+                if line.split() == fields:
+                    print(f"Mount point '{mount_point}' already exists in {FSTAB_PATH}.")
+                    return True
     except FileNotFoundError:
-        print("Error: /etc/fstab not found.")
+        print(f"Error: {FSTAB_PATH} not found.")
         return False
 
-    # Use tee to append the line
+    # The script runs as root, so append directly instead of piping through tee
+    new_line = ' '.join(fields) + '\n'
+    if line and not line.endswith('\n'):
+        new_line = '\n' + new_line
     try:
-        command = f'echo "{fstab_line}" | tee -a /etc/fstab'
-        run(command, check=True, shell=True)
-        print(f"Successfully added '{fstab_line.strip()}' to /etc/fstab.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error adding mount to /etc/fstab. Return code: {e.returncode}")
+        with open(FSTAB_PATH, 'a') as f:
+            f.write(new_line)
+        print(f"Successfully added '{fstab_line.strip()}' to {FSTAB_PATH}.")
+    except OSError as e:
+        print(f"Error adding mount to {FSTAB_PATH}: {e}")
         return False
-    
-    return True
\ No newline at end of file
+
+    return True
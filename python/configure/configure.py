@@ -3,32 +3,25 @@
 import os
 import sys
 import argparse
-import yaml
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
 
-from pyparsing import ABC
-from commands import get_all_commands, get_command
+from abc import ABC
+from commands import get_all_commands, get_command, has_command
 from commands.cmd import BaseCmd
-from commands.utils import numbered_prompt, reboot_prompt, yes_no_prompt
-from commands.nvidia import InstallNvidiaContainerToolkitCmd, InstallNvidiaCudaToolkitCmd, InstallNvidiaDriverCmd, RemoveNvidiaDriverCmd
-from commands.apt_install import AptInstallCmd
-from commands.configure_libvirt import ConfigureLibvirtCmd, CheckVirtualizationCmd
-from commands.configure_grub import ReadGrubCmd, GetIommuTypeCmd, GetGpuPciIdsCmd, AddGrubVirtualizationOptionsCmd, CreateGrubOverrideCmd, RemoveGrubOverrideCmd
-from commands.configure_initramfs import UpdateInitramfsModulesCmd
-from commands.configure_modprobe import CreateVfioConfCmd
-from commands.configure_memory import ConfigureMemoryCmd
-from commands.configure_disks import ConfigureDisksCmd
-from commands.configure_gpu_power import VerifyGpuPowerStateCmd, ConfigureGpuPowerCmd
-from commands.configure_docker import ConfigureDockerCmd
+from commands.utils import flush_boot_updates, flush_restarts, numbered_prompt, reboot_prompt, set_prompt_mode, yes_no_prompt
 
 GRUB_MAIN_FILE = '/etc/default/grub'
 GRUB_D_DIR = '/etc/default/grub.d'
 VFIO_GRUB_FILE = os.path.join(GRUB_D_DIR, '99-cloudrift.cfg')
 
-ALL_COMMANDS = get_all_commands()
 WORKFLOWS = [
 ]
 
+# Cleared by --serial to run every step on its own
+PARALLEL_STEPS = True
+
 # REQUIRED_PACKAGES = [
 #     "qemu-kvm",
 #     "libvirt-daemon-system",
@@ -37,6 +30,14 @@ WORKFLOWS = [
 #     "mdadm"  # RAID devices
 # ]
 
+def require_root():
+    """
+    Exits unless running as root. Called first by every entry point that changes the system.
+    """
+    if os.geteuid() != 0:
+        print("This script must be run with sudo.")
+        sys.exit(1)
+
 def reboot_server():
     """
     Prompts the user to reboot and provides verification instructions.
@@ -72,15 +73,10 @@ class Workflow(ABC):
 
     def execute(self, env: Dict[str, Any]) -> bool | None:
         total_commands = len(self.commands)
-        print(f"📋 Found {total_commands} configuration command(s) to execute:")
-        print("-" * 60)
-        
-        # Print overview of all commands first
-        for i, command in enumerate(self.commands, start=1):
-            print(f"  {i}. {command.command.name()}")
-            print(f"     └─ {command.command.description()}")
-        print("-" * 60)
-        print()
+        # Print overview of all commands first, as one write
+        overview = [f"📋 Found {total_commands} configuration command(s) to execute:", "-" * 60,
+                    *overview_lines(command.command for command in self.commands), "-" * 60, ""]
+        print("\n".join(overview))
 
         # Prompt for confirmation
         if yes_no_prompt("Do you want to proceed with these changes?", default=True) is False:
@@ -89,34 +85,75 @@ class Workflow(ABC):
 
         env = {}  # Shared environment dictionary for commands
 
-        # Execute commands with enhanced output
+        # Group adjacent parallel-safe commands so they run concurrently
+        batches = []
         for i, command in enumerate(self.commands, start=1):
-            print(f"🚀 Step {i}/{total_commands}: {command.command.name()}")
-            print(f"📝 Description: {command.command.description()}")
-            print(f"⏳ Executing...")
-            
-            try:
-                env.update(command.environment)
-                success = command.command.execute(env)
-                if success:
-                    print(f"✅ Step {i}/{total_commands} completed successfully!")
-                else:
-                    print(f"❌ Step {i}/{total_commands} failed!")
-                    print(f"💥 Command '{command.command.name()}' encountered an error. Exiting.")
-                    return False
-            except Exception as e:
-                print(f"❌ Step {i}/{total_commands} failed with exception!")
-                print(f"💥 Error: {str(e)}")
-                print(f"🛑 Command '{command.command.name()}' failed. Exiting.")
+            if (PARALLEL_STEPS and batches and command.command.parallel_safe
+                    and batches[-1][-1][1].command.parallel_safe):
+                batches[-1].append((i, command))
+            else:
+                batches.append([(i, command)])
+
+        # Execute commands with enhanced output
+        for batch in batches:
+            if len(batch) > 1:
+                print(f"⚡ Running steps {batch[0][0]}-{batch[-1][0]} in parallel")
+                # Each step runs on its own copy, so its parameters and results are not seen by
+                # its siblings. What the steps set is merged back once the batch is done.
+                base = dict(env)
+                step_envs = [dict(base) for _ in batch]
+                with ThreadPoolExecutor(max_workers=len(batch)) as executor:
+                    results = list(executor.map(
+                        lambda step, step_env: self.execute_step(*step, total_commands, step_env), batch, step_envs))
+                for step_env in step_envs:
+                    env.update({key: value for key, value in step_env.items()
+                                if key not in base or base[key] is not value})
+            else:
+                results = [self.execute_step(*batch[0], total_commands, env)]
+
+            if not all(results):
+                flush_restarts()
+                flush_boot_updates()
                 return False
 
-            print("-" * 40)
-            print()
+        # Services changed by the commands are restarted once, together, and the boot
+        # files are regenerated once all configuration files are in place
+        restarted = flush_restarts()
+        if not flush_boot_updates() or not restarted:
+            return False
 
         print("🎉 All configuration commands completed successfully!")
         print("=" * 60)        
         return True
 
+    @staticmethod
+    def execute_step(i: int, command: WorkflowCommand, total_commands: int, env: Dict[str, Any]) -> bool:
+        # The header goes out in one print so it stays together; the lines of
+        # parallel steps may still interleave with each other
+        print(f"🚀 Step {i}/{total_commands}: {command.command.name()}\n"
+              f"📝 Description: {command.command.description()}\n"
+              f"⏳ Executing...")
+
+        # Parameters take effect only once their step starts
+        env.update(command.environment)
+
+        try:
+            success = command.command.execute(env)
+            if success:
+                print(f"✅ Step {i}/{total_commands} completed successfully!")
+            else:
+                print(f"❌ Step {i}/{total_commands} failed!")
+                print(f"💥 Command '{command.command.name()}' encountered an error. Exiting.")
+                return False
+        except Exception as e:
+            print(f"❌ Step {i}/{total_commands} failed with exception!")
+            print(f"💥 Error: {str(e)}")
+            print(f"🛑 Command '{command.command.name()}' failed. Exiting.")
+            return False
+
+        print("-" * 40 + "\n")
+        return True
+
 def load_workflow_from_yaml(file_path: str) -> Workflow:
     """
     Load a workflow from a YAML file.
@@ -132,9 +169,14 @@ def load_workflow_from_yaml(file_path: str) -> Workflow:
           - "libvirt-daemon-system"
       - name: "InstallNvidiaDriverCmd"
     """
+    # Imported here so commands that never read YAML do not pay for PyYAML
+    import yaml
+
+    # The libyaml based loader is much faster, it is missing when PyYAML was built without libyaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
     try:
-        with open(file_path, 'r') as file:
-            workflow_data = yaml.safe_load(file)
+        with open(file_path, 'rb') as file:
+            workflow_data = yaml.load(file, Loader=loader)
     except FileNotFoundError:
         raise FileNotFoundError(f"YAML workflow file not found: {file_path}")
     except yaml.YAMLError as e:
@@ -156,9 +198,9 @@ def load_workflow_from_yaml(file_path: str) -> Workflow:
     if not isinstance(commands_data, list):
         raise ValueError("'commands' field must be a list")
     
-    # Create command instances from YAML data
-    command_instances = []
-        
+    # Collect the command names and parameters, the commands are created when first used
+    command_specs = []
+
     for cmd_data in commands_data:
         if isinstance(cmd_data, str):
             # Simple string format: just command name
@@ -174,21 +216,27 @@ def load_workflow_from_yaml(file_path: str) -> Workflow:
         if not cmd_name:
             raise ValueError(f"Command must have a 'name' field: {cmd_data}")
         
-        # Find the command class and create instance
-        command = get_command(cmd_name)
-        if command:
-            # Use existing instance from auto-discovery
-            command_instances.append(WorkflowCommand(command, cmd_params))
-        else:
+        if not has_command(cmd_name):
             raise ValueError(f"Unknown command: {cmd_name}")
+        command_specs.append((cmd_name, cmd_params))
     
     # Create a dynamic workflow class
     class YamlWorkflow(Workflow):
         def __init__(self):
             super().__init__()
-            self.commands = command_instances
             self._name = workflow_name
             self._description = workflow_description
+
+        @functools.cached_property
+        def commands(self) -> list[WorkflowCommand]:
+            # Resolved on first use, so listing workflows imports no command modules
+            command_instances = []
+            for cmd_name, cmd_params in command_specs:
+                command = get_command(cmd_name)
+                if command is None:
+                    raise ValueError(f"Could not load command: {cmd_name}")
+                command_instances.append(WorkflowCommand(command, cmd_params))
+            return command_instances
         
         def name(self) -> str:
             return self._name
@@ -204,19 +252,23 @@ def load_workflows(path: str):
             wf = load_workflow_from_yaml(os.path.join(path, file))
             WORKFLOWS.append(wf)
 
+def overview_lines(items) -> list[str]:
+    """
+    Returns the numbered name and description lines shown for workflows and commands.
+    """
+    lines = []
+    for i, item in enumerate(items, start=1):
+        lines.append(f"  {i}. {item.name()}")
+        lines.append(f"     └─ {item.description()}")
+    return lines
+
 def list_workflows():
     """
     List all available configuration workflows.
     """
-    print("=" * 60)
-    print("📋 AVAILABLE CONFIGURATION WORKFLOWS")
-    print("=" * 60)
-    
-    for i, workflow in enumerate(WORKFLOWS, start=1):
-        print(f"  {i}. {workflow.name()}")
-        print(f"     └─ {workflow.description()}")
-    print("=" * 60)
-    print(f"Total: {len(WORKFLOWS)} workflows available")
+    print("\n".join(["=" * 60, "📋 AVAILABLE CONFIGURATION WORKFLOWS", "=" * 60,
+                     *overview_lines(WORKFLOWS),
+                     "=" * 60, f"Total: {len(WORKFLOWS)} workflows available"]))
 
 def find_workflow(workflow_identifier) -> Workflow | None:
     workflow_to_execute = None
@@ -228,10 +280,8 @@ def find_workflow(workflow_identifier) -> Workflow | None:
             workflow_to_execute = WORKFLOWS[index]
     except ValueError:
         # Not a number, try to find by name
-        for i, workflow in enumerate(WORKFLOWS):
-            if workflow.name().lower() == workflow_identifier.lower():
-                workflow_to_execute = workflow
-                break
+        workflows_by_name = {workflow.name().casefold(): workflow for workflow in WORKFLOWS}
+        workflow_to_execute = workflows_by_name.get(workflow_identifier.casefold())
 
     return workflow_to_execute
 
@@ -239,9 +289,7 @@ def execute_workflow(workflow_identifier):
     """
     Execute a specific workflow by index or name.
     """
-    if os.geteuid() != 0:
-        print("This script must be run with sudo.")
-        sys.exit(1)
+    require_root()
 
     env = {}  # Shared environment dictionary
     workflow_to_execute = find_workflow(workflow_identifier)
@@ -280,13 +328,11 @@ def execute_yaml_workflow(yaml_file_path: str):
     """
     Execute a workflow defined in a YAML file.
     """
-    if os.geteuid() != 0:
-        print("This script must be run with sudo.")
-        sys.exit(1)
+    require_root()
 
     try:
         workflow = load_workflow_from_yaml(yaml_file_path)
-    except (FileNotFoundError, ValueError, yaml.YAMLError) as e:
+    except (FileNotFoundError, ValueError) as e:  # YAML errors are raised as ValueError
         print(f"❌ Error loading YAML workflow: {e}")
         sys.exit(1)
     except Exception as e:
@@ -323,41 +369,39 @@ def list_commands():
     """
     List all available configuration commands.
     """
-    print("=" * 60)
-    print("📋 AVAILABLE CONFIGURATION COMMANDS")
-    print("=" * 60)
-
-    for i, command in enumerate(ALL_COMMANDS, start=1):
-        print(f"  {i}. {command.name()}")
-        print(f"     └─ {command.description()}")
-    print("=" * 60)
-    print(f"Total: {len(ALL_COMMANDS)} commands available")
+    all_commands = list(get_all_commands())
+    print("\n".join(["=" * 60, "📋 AVAILABLE CONFIGURATION COMMANDS", "=" * 60,
+                     *overview_lines(all_commands),
+                     "=" * 60, f"Total: {len(all_commands)} commands available"]))
 
-def execute_specific_command(command_identifier):
+def find_command(command_identifier) -> tuple[int | None, BaseCmd | None]:
     """
-    Execute a specific command by index or name.
+    Finds a command by its index in --list-commands, its class name or its name.
+    Returns the index (None for class names) and the command.
     """
-    if os.geteuid() != 0:
-        print("This script must be run with sudo.")
-        sys.exit(1)
-
-    env = {}  # Shared environment dictionary
-    command_to_execute = None
-    command_index = None
+    # A class name only needs that command's module
+    if has_command(command_identifier):
+        return None, get_command(command_identifier)
 
-    # Try to parse as index first
+    all_commands = list(get_all_commands())
     try:
         index = int(command_identifier) - 1  # Convert to 0-based index
-        if 0 <= index < len(ALL_COMMANDS):
-            command_to_execute = ALL_COMMANDS[index]
-            command_index = index + 1
+        if 0 <= index < len(all_commands):
+            return index + 1, all_commands[index]
+        return None, None
     except ValueError:
         # Not a number, try to find by name
-        for i, command in enumerate(ALL_COMMANDS):
-            if command.name().lower() == command_identifier.lower():
-                command_to_execute = command
-                command_index = i + 1
-                break
+        commands_by_name = {command.name().casefold(): (i, command) for i, command in enumerate(all_commands, start=1)}
+        return commands_by_name.get(command_identifier.casefold(), (None, None))
+
+def execute_specific_command(command_identifier):
+    """
+    Execute a specific command by index or name.
+    """
+    require_root()
+
+    env = {}  # Shared environment dictionary
+    command_index, command_to_execute = find_command(command_identifier)
 
     if command_to_execute is None:
         print(f"❌ Command '{command_identifier}' not found.")
@@ -367,12 +411,14 @@ def execute_specific_command(command_identifier):
     print("=" * 60)
     print("🔧 EXECUTING SPECIFIC COMMAND")
     print("=" * 60)
-    print(f"🚀 Executing command {command_index}: {command_to_execute.name()}")
+    print(f"🚀 Executing command {command_index or command_identifier}: {command_to_execute.name()}")
     print(f"📝 Description: {command_to_execute.description()}")
     print(f"⏳ Executing...")
     
     try:
         success = command_to_execute.execute(env)
+        success = flush_restarts() and success
+        success = flush_boot_updates() and success
         if success:
             print(f"✅ Command completed successfully!")
         else:
@@ -401,6 +447,8 @@ Examples:
   configure.py --workflow <index or name>   # Execute a specific workflow
   configure.py --yaml-workflow <file.yaml>  # Execute workflow from YAML file
   configure.py --command <index or name>    # Execute command
+  configure.py --yes --workflow <index or name>  # Execute a workflow without prompts
+  configure.py --yes --nvidia-driver <package> --cuda-package <package> --workflow <index or name>
         """
     )
 
@@ -434,20 +482,64 @@ Examples:
         help="Execute only the specified command (by number or name)"
     )
     
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="Do not prompt, answer every question with its default (no reboot)"
+    )
+
+    parser.add_argument(
+        "--no-reboot",
+        action="store_true",
+        help="Do not offer to reboot when a step requires it"
+    )
+
+    parser.add_argument(
+        "--serial",
+        action="store_true",
+        help="Run workflow steps one at a time, e.g. to read their output while debugging"
+    )
+
+    parser.add_argument(
+        "--nvidia-driver",
+        metavar="PACKAGE",
+        help="NVIDIA driver package to install instead of asking, e.g. nvidia-driver-580"
+    )
+
+    parser.add_argument(
+        "--cuda-package",
+        metavar="PACKAGE",
+        help="CUDA Toolkit package to install instead of asking, e.g. cuda-toolkit-13"
+    )
+
     args = parser.parse_args()
-    
+    global PARALLEL_STEPS
+    PARALLEL_STEPS = not args.serial
+    choices = {'nvidia-driver': args.nvidia_driver, 'cuda-package': args.cuda_package}
+    set_prompt_mode(accept_defaults=args.yes, skip_reboot=args.no_reboot,
+                    choices={name: value for name, value in choices.items() if value})
+
+    # These do not use the bundled workflows
+    if args.list_commands:
+        list_commands()
+        return
+    if args.command:
+        execute_specific_command(args.command)
+        return
+    if args.yaml_workflow:
+        execute_yaml_workflow(args.yaml_workflow)
+        return
+
+    if not args.list_workflows:
+        # Fail before loading anything if the workflow could not run anyway
+        require_root()
+
     path = os.path.dirname(os.path.abspath(__file__)) + '/workflows'
     print("Loading workflows from:", path)
     load_workflows(path)
 
     if args.list_workflows:
         list_workflows()
-    elif args.list_commands:
-        list_commands()
-    elif args.command:
-        execute_specific_command(args.command)
-    elif args.yaml_workflow:
-        execute_yaml_workflow(args.yaml_workflow)
     elif args.workflow:
         execute_workflow(args.workflow)
     else:
@@ -0,0 +1,48 @@
+import sys
+import os
+
+# Add the parent directory to the path so we can import the module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from configure.commands import check_setup
+from configure.commands.check_setup import check_vfio_driver_lspci
+
+LSPCI_VFIO = b"""00:00.0 Host bridge: Intel Corporation Device 4660 (rev 02)
+\tSubsystem: ASUSTeK Computer Inc. Device 8694
+\tKernel driver in use: igen6_edac
+01:00.0 VGA compatible controller: NVIDIA Corporation GA102 [GeForce RTX 3090] (rev a1)
+\tSubsystem: NVIDIA Corporation Device 1467
+\tKernel driver in use: vfio-pci
+\tKernel modules: nvidiafb, nouveau
+01:00.1 Audio device: NVIDIA Corporation GA102 High Definition Audio Controller (rev a1)
+\tSubsystem: NVIDIA Corporation Device 1467
+\tKernel driver in use: vfio-pci
+\tKernel modules: snd_hda_intel
+"""
+
+LSPCI_NVIDIA = b"""01:00.0 VGA compatible controller: NVIDIA Corporation GA102 [GeForce RTX 3090] (rev a1)
+\tSubsystem: NVIDIA Corporation Device 1467
+\tKernel driver in use: nvidia
+\tKernel modules: nvidiafb, nouveau, nvidia_drm, nvidia
+"""
+
+
+class TestCheckVfioDriverLspci:
+    """Test cases for the check_vfio_driver_lspci function."""
+
+    def test_subsystem_lines(self, monkeypatch, capsys):
+        """Test that NVIDIA Subsystem lines are not mistaken for new devices."""
+        monkeypatch.setattr(check_setup.subprocess, 'check_output', lambda cmd: LSPCI_VFIO)
+
+        assert check_vfio_driver_lspci() is True
+        output = capsys.readouterr().out
+        assert output.count("Found NVIDIA device") == 2
+        assert output.count("(SUCCESS)") == 2
+        assert "NOT in use" not in output
+
+    def test_other_driver(self, monkeypatch, capsys):
+        """Test that a device bound to another driver is reported."""
+        monkeypatch.setattr(check_setup.subprocess, 'check_output', lambda cmd: LSPCI_NVIDIA)
+
+        assert check_vfio_driver_lspci() is False
+        assert capsys.readouterr().out.count("NOT in use") == 1
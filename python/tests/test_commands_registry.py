@@ -0,0 +1,60 @@
+import inspect
+from importlib import import_module
+import sys
+import os
+
+# Add the parent directory to the path so we can import the module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from configure import commands
+from configure.commands import get_command, rebuild_registry
+from configure.commands.cmd import BaseCmd
+
+
+def _command_subclasses(cls):
+    """Recursively collect all concrete BaseCmd subclasses."""
+    for subclass in cls.__subclasses__():
+        if not inspect.isabstract(subclass):
+            yield subclass
+        yield from _command_subclasses(subclass)
+
+
+class TestCommandRegistry:
+    """Test cases for the lazy command registry."""
+
+    def test_registry_matches_module_exports(self):
+        """Every registered command is exported by its module and vice versa."""
+        registered = {}
+        for name, target in commands._REGISTRY.items():
+            module_name, class_name = target.split(":")
+            assert name == class_name
+            registered.setdefault(module_name, set()).add(class_name)
+
+        for module_name, class_names in registered.items():
+            module = import_module('.' + module_name, package=commands.__name__)
+            assert set(module.__all__) == class_names
+
+    def test_all_commands_registered(self):
+        """Every concrete BaseCmd subclass in the package is registered."""
+        for module_name in {target.split(":")[0] for target in commands._REGISTRY.values()}:
+            import_module('.' + module_name, package=commands.__name__)
+
+        defined = {cls.__name__ for cls in _command_subclasses(BaseCmd)
+                   if cls.__module__.startswith(commands.__name__)}
+        assert defined == set(commands._REGISTRY)
+
+    def test_get_command_returns_cached_instance(self):
+        """Looking up a command twice returns the same instance."""
+        command = get_command("ReadGrubCmd")
+        assert command is not None
+        assert command is get_command("ReadGrubCmd")
+
+    def test_rebuild_registry(self):
+        """Rebuilding the registry drops cached instances."""
+        command = get_command("ReadGrubCmd")
+        rebuild_registry()
+        assert get_command("ReadGrubCmd") is not command
+
+    def test_get_unknown_command(self):
+        """Unknown command names return None."""
+        assert get_command("NoSuchCmd") is None
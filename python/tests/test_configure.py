@@ -0,0 +1,93 @@
+import importlib.util
+import subprocess
+import sys
+import os
+
+import pytest
+
+# Add the parent directory to the path so we can import the module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+CONFIGURE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'configure'))
+
+
+def _modules_after(code):
+    """Runs the code in a fresh interpreter and returns the names of all loaded modules."""
+    code = f"import sys; sys.path.insert(0, {CONFIGURE_DIR!r}); {code}; print('\\n'.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return set(result.stdout.split())
+
+
+class TestConfigureImports:
+    """Test cases for the modules loaded when the CLI starts."""
+
+    def test_no_pyparsing(self):
+        """The CLI does not pull in pyparsing."""
+        assert 'pyparsing' not in _modules_after('import configure')
+
+    def test_no_yaml_without_workflows(self):
+        """PyYAML is only imported when a workflow file is parsed."""
+        assert 'yaml' not in _modules_after('import configure; configure.list_commands()')
+
+    def test_listing_workflows_is_lazy(self):
+        """Loading and listing workflows does not import any command module."""
+        workflows_dir = os.path.join(CONFIGURE_DIR, 'workflows')
+        modules = _modules_after(f"import configure; configure.load_workflows({workflows_dir!r}); configure.list_workflows()")
+        assert 'commands.utils' in modules
+        assert not {'commands.nvidia', 'commands.configure_grub', 'commands.configure_libvirt'} & modules
+
+
+class TestWorkflowEnvironment:
+    """Test cases for the environment seen by the steps of a workflow."""
+
+    @pytest.fixture
+    def configure(self, monkeypatch):
+        # Other tests import the configure package, so load the script under its own name
+        monkeypatch.syspath_prepend(CONFIGURE_DIR)
+        spec = importlib.util.spec_from_file_location('configure_script', os.path.join(CONFIGURE_DIR, 'configure.py'))
+        configure = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(configure)
+        monkeypatch.setattr(configure, 'yes_no_prompt', lambda *args, **kwargs: True)
+        monkeypatch.setattr(configure, 'flush_restarts', lambda: True)
+        monkeypatch.setattr(configure, 'flush_boot_updates', lambda: True)
+        monkeypatch.setattr(configure, 'PARALLEL_STEPS', True)
+        return configure
+
+    def _workflow(self, configure, commands):
+        from commands.cmd import BaseCmd
+
+        class RecordCmd(BaseCmd):
+            def __init__(self, key, seen, parallel_safe):
+                self.key = key
+                self.seen = seen
+                self.parallel_safe = parallel_safe
+
+            def name(self):
+                return f"Record {self.key}"
+
+            def description(self):
+                return "Records the environment it runs with."
+
+            def execute(self, env):
+                self.seen[self.key] = dict(env)
+                env[f"{self.key}_result"] = True
+                return True
+
+        class TestWorkflow(configure.Workflow):
+            pass
+
+        seen = {}
+        workflow = TestWorkflow()
+        workflow.commands = [configure.WorkflowCommand(RecordCmd(key, seen, parallel_safe), environment)
+                             for key, environment, parallel_safe in commands]
+        return workflow, seen
+
+    def test_parallel_steps_are_isolated(self, configure):
+        """Test that parallel steps see only their own parameters and later steps see all results."""
+        workflow, seen = self._workflow(configure, [('a', {'param_a': 1}, True), ('b', {'param_b': 2}, True),
+                                                    ('c', {}, False)])
+
+        assert workflow.execute({}) is True
+        assert seen['a'] == {'param_a': 1}
+        assert seen['b'] == {'param_b': 2}
+        assert seen['c'] == {'param_a': 1, 'a_result': True, 'param_b': 2, 'b_result': True}
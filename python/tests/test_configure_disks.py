@@ -0,0 +1,36 @@
+import sys
+import os
+
+import pytest
+
+# Add the parent directory to the path so we can import the module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from configure.commands import configure_disks
+from configure.commands.configure_disks import find_unused_whole_disks
+
+LSBLK_OUTPUT = """NAME="sda" TYPE="disk" PKNAME="" MOUNTPOINT="" FSTYPE=""
+NAME="sda1" TYPE="part" PKNAME="sda" MOUNTPOINT="/" FSTYPE="ext4"
+NAME="sdb" TYPE="disk" PKNAME="" MOUNTPOINT="" FSTYPE="ext4"
+NAME="sdc" TYPE="disk" PKNAME="" MOUNTPOINT="" FSTYPE=""
+NAME="sdd" TYPE="disk" PKNAME="" MOUNTPOINT="/data" FSTYPE="xfs"
+"""
+
+
+class TestFindUnusedWholeDisks:
+    """Test cases for the find_unused_whole_disks function."""
+
+    @pytest.fixture(autouse=True)
+    def lsblk(self, monkeypatch):
+        monkeypatch.setattr(configure_disks, 'run', lambda *args, **kwargs: (LSBLK_OUTPUT, None, 0))
+        configure_disks._scan_unused_whole_disks.cache_clear()
+        yield
+        configure_disks._scan_unused_whole_disks.cache_clear()
+
+    def test_skips_used_disks(self):
+        """Test that partitioned, mounted and already formatted disks are not offered."""
+        assert find_unused_whole_disks() == ['sdc']
+
+    def test_dev_prefix(self):
+        """Test that device paths are returned when asked for."""
+        assert find_unused_whole_disks(add_dev_prefix=True) == ['/dev/sdc']
@@ -0,0 +1,153 @@
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from configure.commands import configure_grub
+from configure.commands.configure_grub import (AddGrubVirtualizationOptionsCmd, create_grub_override,
+                                              get_existing_grub_parameters, grub_sources, read_options_from_file)
+
+
+class TestReadOptionsFromFile:
+    """Test cases for the read_options_from_file function."""
+
+    def test_reads_named_parameter(self, tmp_path):
+        """Test that only the requested parameter is read."""
+        grub_file = tmp_path / "grub"
+        grub_file.write_text("""GRUB_DEFAULT=0
+GRUB_CMDLINE_LINUX_DEFAULT="quiet splash"
+GRUB_CMDLINE_LINUX="console=ttyS0"
+""")
+
+        assert read_options_from_file(grub_file, 'GRUB_CMDLINE_LINUX_DEFAULT') == ['quiet', 'splash']
+        assert read_options_from_file(grub_file, 'GRUB_CMDLINE_LINUX') == ['console=ttyS0']
+
+    def test_multiple_assignments(self, tmp_path):
+        """Test that options from repeated assignments are combined in order."""
+        grub_file = tmp_path / "grub"
+        grub_file.write_text("""GRUB_CMDLINE_LINUX_DEFAULT="quiet"
+GRUB_CMDLINE_LINUX_DEFAULT="iommu=pt nomodeset"
+""")
+
+        assert read_options_from_file(grub_file, 'GRUB_CMDLINE_LINUX_DEFAULT') == ['quiet', 'iommu=pt', 'nomodeset']
+
+    def test_commented_assignment(self, tmp_path):
+        """Test that commented out assignments are ignored."""
+        grub_file = tmp_path / "grub"
+        grub_file.write_text("""#GRUB_CMDLINE_LINUX_DEFAULT="nomodeset"
+GRUB_CMDLINE_LINUX_DEFAULT="quiet"
+""")
+
+        assert read_options_from_file(grub_file, 'GRUB_CMDLINE_LINUX_DEFAULT') == ['quiet']
+
+    def test_missing_parameter(self, tmp_path):
+        """Test a file without the parameter."""
+        grub_file = tmp_path / "grub"
+        grub_file.write_text("GRUB_DEFAULT=0\n")
+
+        assert read_options_from_file(grub_file, 'GRUB_CMDLINE_LINUX') == []
+
+
+class TestGetExistingGrubParameters:
+    """Test cases for the get_existing_grub_parameters function."""
+
+    @pytest.fixture
+    def grub_d(self, tmp_path, monkeypatch):
+        grub_main = tmp_path / "grub"
+        grub_main.write_text('GRUB_CMDLINE_LINUX_DEFAULT="quiet splash"\nGRUB_CMDLINE_LINUX=""\n')
+        grub_d = tmp_path / "grub.d"
+        grub_d.mkdir()
+        monkeypatch.setattr(configure_grub, 'GRUB_MAIN_FILE', str(grub_main))
+        monkeypatch.setattr(configure_grub, 'GRUB_D_DIR', str(grub_d))
+        grub_sources.cache_clear()
+        yield grub_d
+        grub_sources.cache_clear()
+
+    def test_combines_overrides(self, grub_d):
+        """Test that overrides are applied in file name order without duplicates."""
+        (grub_d / "50-a.cfg").write_text('GRUB_CMDLINE_LINUX_DEFAULT="splash iommu=pt"\n')
+        (grub_d / "60-b.cfg").write_text('GRUB_CMDLINE_LINUX="console=ttyS0"\n')
+        (grub_d / "70-c.txt").write_text('GRUB_CMDLINE_LINUX="ignored"\n')
+
+        assert get_existing_grub_parameters('GRUB_CMDLINE_LINUX_DEFAULT') == ['quiet', 'splash', 'iommu=pt']
+        assert get_existing_grub_parameters('GRUB_CMDLINE_LINUX') == ['console=ttyS0']
+
+    def test_missing_grub_d(self, grub_d):
+        """Test that a missing grub.d directory is not an error."""
+        grub_d.rmdir()
+
+        assert get_existing_grub_parameters('GRUB_CMDLINE_LINUX_DEFAULT') == ['quiet', 'splash']
+
+
+class TestAddGrubVirtualizationOptions:
+    """Test cases for AddGrubVirtualizationOptionsCmd."""
+
+    @pytest.fixture
+    def env(self):
+        return {
+            'IOMMU_TYPE': 'intel_iommu=on',
+            'GPU_PCI_IDS': ['10de:2204'],
+            'GRUB_CMDLINE_LINUX_DEFAULT': ['quiet', 'intel_iommu=on', 'vfio-pci.ids=10de:1111'],
+        }
+
+    def test_adds_missing_options(self, env):
+        """Test that options with similar names are not treated as duplicates."""
+        assert AddGrubVirtualizationOptionsCmd().execute(env) is True
+
+        options = env['GRUB_CMDLINE_LINUX_DEFAULT'].split()
+        assert 'iommu=pt' in options
+        assert 'pci=realloc' in options
+        assert 'pci=noaer' in options
+        assert options.count('intel_iommu=on') == 1
+
+    def test_replaces_vfio_ids(self, env):
+        """Test that existing vfio-pci.ids are replaced with the detected ones."""
+        AddGrubVirtualizationOptionsCmd().execute(env)
+
+        options = env['GRUB_CMDLINE_LINUX_DEFAULT'].split()
+        assert 'vfio-pci.ids=10de:2204' in options
+        assert 'vfio-pci.ids=10de:1111' not in options
+
+    def test_skip_vfio_binding(self, env):
+        """Test that vfio options are dropped when binding is skipped."""
+        env['skip_vfio_binding'] = True
+        AddGrubVirtualizationOptionsCmd().execute(env)
+
+        options = env['GRUB_CMDLINE_LINUX_DEFAULT'].split()
+        assert not any(opt.startswith(('vfio-pci.ids=', 'modprobe.blacklist=')) for opt in options)
+
+
+class TestCreateGrubOverride:
+    """Test cases for the create_grub_override function."""
+
+    @pytest.fixture
+    def grub_file(self, tmp_path, monkeypatch):
+        grub_d = tmp_path / "grub.d"
+        grub_file = grub_d / "99-cloudrift.cfg"
+        monkeypatch.setattr(configure_grub, 'GRUB_D_DIR', str(grub_d))
+        monkeypatch.setattr(configure_grub, 'VFIO_GRUB_FILE', str(grub_file))
+        return grub_file
+
+    def test_creates_file(self, grub_file):
+        """Test that a missing override file is created."""
+        options = {'GRUB_CMDLINE_LINUX_DEFAULT': 'quiet iommu=pt', 'GRUB_CMDLINE_LINUX': ['console=ttyS0']}
+
+        assert create_grub_override(options) is True
+        assert read_options_from_file(grub_file, 'GRUB_CMDLINE_LINUX_DEFAULT') == ['quiet', 'iommu=pt']
+        assert read_options_from_file(grub_file, 'GRUB_CMDLINE_LINUX') == ['console=ttyS0']
+
+    def test_unchanged_options(self, grub_file):
+        """Test that an up to date override file is left alone."""
+        options = {'GRUB_CMDLINE_LINUX_DEFAULT': 'quiet iommu=pt', 'GRUB_CMDLINE_LINUX': ''}
+        create_grub_override(options)
+
+        assert create_grub_override(options) is False
+
+    def test_changed_options(self, grub_file):
+        """Test that an outdated override file is rewritten."""
+        create_grub_override({'GRUB_CMDLINE_LINUX_DEFAULT': 'quiet', 'GRUB_CMDLINE_LINUX': ''})
+
+        assert create_grub_override({'GRUB_CMDLINE_LINUX_DEFAULT': 'quiet iommu=pt', 'GRUB_CMDLINE_LINUX': ''}) is True
+        assert read_options_from_file(grub_file, 'GRUB_CMDLINE_LINUX_DEFAULT') == ['quiet', 'iommu=pt']
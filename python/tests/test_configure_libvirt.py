@@ -23,21 +23,12 @@ def capture_file_write(mock_qemu_conf):
     """Fixture to capture file write operations."""
     written_content = None
 
-    def capture_write(*args, **kwargs):
+    def capture_write(path, data):
         nonlocal written_content
-        mock_file = MagicMock()
-        mock_file.__enter__ = MagicMock()
-        mock_file.__exit__ = MagicMock()
+        written_content = data.decode()
 
-        def write_handler(content):
-            nonlocal written_content
-            written_content = content
-
-        mock_file.__enter__.return_value.write = write_handler
-        return mock_file
-
-    mock_qemu_conf.open = MagicMock(side_effect=capture_write)
-    return lambda: written_content
+    with patch('configure.commands.configure_libvirt.atomic_write_bytes', side_effect=capture_write):
+        yield lambda: written_content
 
 
 class TestEnsureQemuConfLines:
@@ -48,7 +39,7 @@ class TestEnsureQemuConfLines:
         mock_qemu_conf.exists.return_value = True
         mock_qemu_conf.read_text.return_value = ""
 
-        result = ensure_qemu_conf_lines()
+        result, _ = ensure_qemu_conf_lines()
 
         assert result is True, "Should return True for modifications made"
         written_content = capture_file_write()
@@ -63,7 +54,7 @@ class TestEnsureQemuConfLines:
 #group = "qemu"
 # Other config"""
 
-        result = ensure_qemu_conf_lines()
+        result, _ = ensure_qemu_conf_lines()
 
         assert result is True
         written_content = capture_file_write()
@@ -81,7 +72,7 @@ class TestEnsureQemuConfLines:
 #  group = "qemu"
 # Other config"""
 
-        result = ensure_qemu_conf_lines()
+        result, _ = ensure_qemu_conf_lines()
 
         assert result is True
         written_content = capture_file_write()
@@ -97,7 +88,7 @@ user = "root"
 group = "root"
 # Other settings"""
 
-        result = ensure_qemu_conf_lines()
+        result, _ = ensure_qemu_conf_lines()
 
         assert result is False, "Should return False when already configured"
 
@@ -109,7 +100,7 @@ user = "qemu"
 group = "kvm"
 # Other settings"""
 
-        result = ensure_qemu_conf_lines()
+        result, _ = ensure_qemu_conf_lines()
 
         assert result is True
         written_content = capture_file_write()
@@ -127,7 +118,7 @@ group = "kvm"
 group = "kvm"
 # Other settings"""
 
-        result = ensure_qemu_conf_lines()
+        result, _ = ensure_qemu_conf_lines()
 
         assert result is True
         written_content = capture_file_write()
@@ -142,7 +133,7 @@ group = "kvm"
         mock_qemu_conf.exists.return_value = False
         mock_qemu_conf.read_text.return_value = ""
 
-        result = ensure_qemu_conf_lines()
+        result, _ = ensure_qemu_conf_lines()
 
         assert result is True
         written_content = capture_file_write()
@@ -165,7 +156,7 @@ group = "kvm"
 # Whether libvirt should dynamically change file ownership
 #dynamic_ownership = 1"""
 
-        result = ensure_qemu_conf_lines()
+        result, _ = ensure_qemu_conf_lines()
 
         assert result is True
 
@@ -191,7 +182,7 @@ user = "root"
 #group = "qemu"
 # Other settings"""
 
-        result = ensure_qemu_conf_lines()
+        result, _ = ensure_qemu_conf_lines()
 
         assert result is True
         written_content = capture_file_write()
@@ -210,7 +201,7 @@ user = "root"
 group = "root"
 # Other settings"""
 
-        result = ensure_qemu_conf_lines()
+        result, _ = ensure_qemu_conf_lines()
 
         assert result is True
         written_content = capture_file_write()
@@ -222,6 +213,26 @@ group = "root"
         assert group_count == 1
 
 
+    def test_similar_setting_names(self, mock_qemu_conf, capture_file_write):
+        """Test that settings ending in user/group are not mistaken for them."""
+        mock_qemu_conf.exists.return_value = True
+        mock_qemu_conf.read_text.return_value = """# Config
+swtpm_user = "root"
+swtpm_group = "root"
+#user = "qemu"
+#group = "qemu"
+# Other settings"""
+
+        result, _ = ensure_qemu_conf_lines()
+
+        assert result is True
+        lines = capture_file_write().splitlines()
+        assert 'swtpm_user = "root"' in lines
+        assert 'swtpm_group = "root"' in lines
+        assert 'user = "root"' in lines
+        assert 'group = "root"' in lines
+
+
 class TestVerifyQemuConf:
     """Test cases for the verify_qemu_conf function."""
 
@@ -291,6 +302,21 @@ group = "kvm"
         assert result is False
 
 
+    def test_verify_given_contents(self, mock_qemu_conf, capture_file_write):
+        """Test verify_qemu_conf with the contents returned by ensure_qemu_conf_lines."""
+        mock_qemu_conf.exists.return_value = True
+        mock_qemu_conf.read_text.return_value = """# Config
+#user = "qemu"
+#group = "qemu"
+"""
+
+        _, contents = ensure_qemu_conf_lines()
+        mock_qemu_conf.read_text.reset_mock()
+
+        assert verify_qemu_conf(contents) is True
+        mock_qemu_conf.read_text.assert_not_called()
+
+
 @pytest.mark.parametrize("input_content,expected_result,expected_modifications", [
     ("", True, True),  # Empty file
     ("user = \"root\"\ngroup = \"root\"", False, False),  # Already configured
@@ -304,7 +330,7 @@ def test_parametrized_ensure_qemu_conf_lines(mock_qemu_conf, capture_file_write,
     mock_qemu_conf.exists.return_value = True
     mock_qemu_conf.read_text.return_value = input_content
 
-    result = ensure_qemu_conf_lines()
+    result, _ = ensure_qemu_conf_lines()
 
     assert result == expected_result
 
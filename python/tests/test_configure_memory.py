@@ -0,0 +1,43 @@
+import sys
+import os
+
+# Add the parent directory to the path so we can import the module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from configure.commands.configure_memory import add_hugepages_to_grub_options
+
+
+class TestAddHugepagesToGrubOptions:
+    """Test cases for the add_hugepages_to_grub_options function."""
+
+    def test_adds_hugepages(self):
+        """Test adding hugepages to a command line without them."""
+        options = add_hugepages_to_grub_options({'GRUB_CMDLINE_LINUX_DEFAULT': 'quiet splash',
+                                                 'GRUB_CMDLINE_LINUX': ''}, 16)
+
+        assert options['GRUB_CMDLINE_LINUX_DEFAULT'] == 'quiet splash default_hugepagesz=1G hugepagesz=1G hugepages=16'
+        assert options['GRUB_CMDLINE_LINUX'] == ''
+
+    def test_replaces_existing_hugepages(self):
+        """Test that existing hugepage options are removed from both command lines."""
+        options = add_hugepages_to_grub_options({
+            'GRUB_CMDLINE_LINUX_DEFAULT': 'quiet default_hugepagesz=2M hugepagesz=2M hugepages=512 iommu=pt',
+            'GRUB_CMDLINE_LINUX': ['console=ttyS0', 'hugepages=8'],
+        }, 32)
+
+        assert options['GRUB_CMDLINE_LINUX_DEFAULT'] == 'quiet iommu=pt default_hugepagesz=1G hugepagesz=1G hugepages=32'
+        assert options['GRUB_CMDLINE_LINUX'] == 'console=ttyS0'
+
+    def test_enable_5level_paging(self):
+        """Test that la57 is added exactly once."""
+        options = add_hugepages_to_grub_options({'GRUB_CMDLINE_LINUX_DEFAULT': 'la57 quiet',
+                                                 'GRUB_CMDLINE_LINUX': ''}, 4, enable_5level_paging=True)
+
+        assert options['GRUB_CMDLINE_LINUX_DEFAULT'] == 'quiet default_hugepagesz=1G hugepagesz=1G hugepages=4 la57'
+
+    def test_empty_options(self):
+        """Test with no existing GRUB options."""
+        options = add_hugepages_to_grub_options({}, 2)
+
+        assert options['GRUB_CMDLINE_LINUX_DEFAULT'] == 'default_hugepagesz=1G hugepagesz=1G hugepages=2'
+        assert options['GRUB_CMDLINE_LINUX'] == ''
@@ -0,0 +1,276 @@
+import gzip
+import sys
+import os
+
+import pytest
+
+# Add the parent directory to the path so we can import the module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from configure.commands import utils
+from configure.commands.utils import (add_mp_to_fstab, apt_package_names, apt_search, atomic_write_bytes, file_matches,
+                                      flush_boot_updates, natural_sort_key, preset_choice, reboot_prompt,
+                                      schedule_boot_update, set_prompt_mode, yes_no_prompt)
+
+
+class TestFileMatches:
+    """Test cases for the file_matches function."""
+
+    def test_same_content(self, tmp_path):
+        """Test a file holding exactly the expected bytes."""
+        conf = tmp_path / "test.conf"
+        conf.write_bytes(b"options vfio-pci disable_idle_d3=1\n")
+
+        assert file_matches(conf, b"options vfio-pci disable_idle_d3=1\n") is True
+
+    def test_different_content_same_size(self, tmp_path):
+        """Test a file with the same size but different content."""
+        conf = tmp_path / "test.conf"
+        conf.write_bytes(b"options vfio-pci disable_idle_d3=0\n")
+
+        assert file_matches(conf, b"options vfio-pci disable_idle_d3=1\n") is False
+
+    def test_different_size(self, tmp_path):
+        """Test a file with a different size."""
+        conf = tmp_path / "test.conf"
+        conf.write_bytes(b"options vfio-pci disable_idle_d3=1")
+
+        assert file_matches(conf, b"options vfio-pci disable_idle_d3=1\n") is False
+
+    def test_missing_file(self, tmp_path):
+        """Test a file that does not exist."""
+        assert file_matches(tmp_path / "missing.conf", b"") is False
+
+
+class TestAtomicWriteBytes:
+    """Test cases for the atomic_write_bytes function."""
+
+    def test_creates_file(self, tmp_path):
+        """Test writing a new file."""
+        conf = tmp_path / "test.conf"
+        atomic_write_bytes(conf, b"blacklist nvidia_drm\n")
+
+        assert conf.read_bytes() == b"blacklist nvidia_drm\n"
+        assert list(tmp_path.iterdir()) == [conf]
+
+    def test_replaces_file_and_keeps_mode(self, tmp_path):
+        """Test replacing an existing file keeps its permissions."""
+        conf = tmp_path / "test.conf"
+        conf.write_bytes(b"old content\n")
+        conf.chmod(0o600)
+
+        atomic_write_bytes(conf, b"new\n")
+
+        assert conf.read_bytes() == b"new\n"
+        assert conf.stat().st_mode & 0o777 == 0o600
+
+
+class TestAptPackageNames:
+    """Test cases for reading package names from the apt lists."""
+
+    @pytest.fixture
+    def lists_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(utils, 'APT_LISTS_DIR', str(tmp_path))
+        apt_package_names.cache_clear()
+        apt_search.cache_clear()
+        yield tmp_path
+        apt_package_names.cache_clear()
+        apt_search.cache_clear()
+
+    def test_plain_and_gzip_lists(self, lists_dir):
+        """Test that packages are read from plain and gzip-compressed lists."""
+        (lists_dir / "archive.ubuntu.com_ubuntu_dists_noble_main_binary-amd64_Packages").write_bytes(
+            b"Package: nvidia-driver-550\nVersion: 550.1\n\nPackage: zlib1g\nVersion: 1.3\n")
+        with gzip.open(lists_dir / "developer.download.nvidia.com_cuda_Packages.gz", 'wb') as f:
+            f.write(b"Package: cuda-toolkit-12-8\nDescription: Package: not-a-package\n")
+
+        assert apt_package_names() == {'nvidia-driver-550', 'zlib1g', 'cuda-toolkit-12-8'}
+        assert apt_search('nvidia-driver') == ('nvidia-driver-550',)
+
+    def test_names_across_chunks(self, lists_dir, monkeypatch):
+        """Test that package lines split between read chunks are still found."""
+        monkeypatch.setattr(utils, 'APT_LIST_CHUNK_SIZE', 7)
+        (lists_dir / "archive.ubuntu.com_ubuntu_dists_noble_main_binary-amd64_Packages").write_bytes(
+            b"Package: nvidia-driver-550\nVersion: 550.1\n\nPackage: nvidia-driver-570-server")
+
+        assert apt_package_names() == {'nvidia-driver-550', 'nvidia-driver-570-server'}
+
+    def test_unreadable_compression(self, lists_dir):
+        """Test that lists in an unsupported format make the caller fall back to apt-cache."""
+        (lists_dir / "archive.ubuntu.com_ubuntu_dists_noble_main_binary-amd64_Packages.lz4").write_bytes(b"")
+
+        assert apt_package_names() is None
+
+
+class TestNaturalSortKey:
+    """Test cases for the natural_sort_key function."""
+
+    def test_numbers_sorted_numerically(self):
+        """Test that embedded numbers are compared by value."""
+        packages = ['cuda-toolkit-12-10', 'cuda-toolkit-12-9', 'nvidia-cuda-toolkit']
+        assert sorted(packages, key=natural_sort_key) == ['cuda-toolkit-12-9', 'cuda-toolkit-12-10', 'nvidia-cuda-toolkit']
+
+    def test_driver_variants(self):
+        """Test that driver variants stay next to their version."""
+        drivers = ['nvidia-driver-550', 'nvidia-driver-535-server', 'nvidia-driver-90', 'nvidia-driver-535']
+        assert sorted(drivers, key=natural_sort_key) == [
+            'nvidia-driver-90', 'nvidia-driver-535', 'nvidia-driver-535-server', 'nvidia-driver-550']
+
+
+class TestAddMpToFstab:
+    """Test cases for the add_mp_to_fstab function."""
+
+    @pytest.fixture
+    def fstab(self, tmp_path, monkeypatch):
+        fstab = tmp_path / "fstab"
+        monkeypatch.setattr(utils, 'FSTAB_PATH', str(fstab))
+        return fstab
+
+    def test_appends_line(self, fstab):
+        """Test that a new mount is appended as its own line."""
+        fstab.write_text("UUID=1234 / ext4 defaults 0 1")
+
+        assert add_mp_to_fstab("none /mnt/hugepages hugetlbfs pagesize=1G 0 0\n", "/mnt/hugepages") is True
+        assert fstab.read_text() == "UUID=1234 / ext4 defaults 0 1\nnone /mnt/hugepages hugetlbfs pagesize=1G 0 0\n"
+
+    def test_existing_line(self, fstab):
+        """Test that an existing mount is not added twice."""
+        fstab.write_text("none /mnt/hugepages hugetlbfs pagesize=1G 0 0\n")
+
+        assert add_mp_to_fstab("none /mnt/hugepages hugetlbfs pagesize=1G 0 0\n", "/mnt/hugepages") is True
+        assert fstab.read_text() == "none /mnt/hugepages hugetlbfs pagesize=1G 0 0\n"
+
+    def test_existing_line_different_spacing(self, fstab):
+        """Test that an entry differing only in whitespace counts as existing."""
+        fstab.write_text("none\t/mnt/hugepages  hugetlbfs pagesize=1G 0 0\nUUID=1234 / ext4 defaults 0 1\n")
+
+        assert add_mp_to_fstab("none /mnt/hugepages hugetlbfs pagesize=1G 0 0\n", "/mnt/hugepages") is True
+        assert fstab.read_text().count("/mnt/hugepages") == 1
+
+    def test_commented_entry_is_not_a_match(self, fstab):
+        """Test that a commented out entry containing the line is not treated as a match."""
+        fstab.write_text("#UUID=1234 /data ext4 defaults 0 0\n")
+
+        assert add_mp_to_fstab("UUID=1234 /data ext4 defaults 0 0\n", "/data") is True
+        assert fstab.read_text() == "#UUID=1234 /data ext4 defaults 0 0\nUUID=1234 /data ext4 defaults 0 0\n"
+
+    def test_missing_fstab(self, fstab):
+        """Test that a missing fstab is reported as an error."""
+        assert add_mp_to_fstab("none /mnt/hugepages hugetlbfs pagesize=1G 0 0\n", "/mnt/hugepages") is False
+
+
+class TestYesNoPrompt:
+    """Test cases for the yes_no_prompt function."""
+
+    @pytest.mark.parametrize("answer, default, expected", [
+        ("", True, True),
+        ("", False, False),
+        ("y", False, True),
+        (" Yes ", False, True),
+        ("n", True, False),
+        ("no", True, False),
+    ])
+    def test_answers(self, monkeypatch, answer, default, expected):
+        """Test that answers and the default are interpreted correctly."""
+        monkeypatch.setattr('builtins.input', lambda: answer)
+        assert yes_no_prompt("Continue?", default) is expected
+
+    def test_accept_defaults(self, monkeypatch):
+        """Test that stdin is not read when defaults are accepted."""
+        monkeypatch.setattr(utils, '_accept_defaults', True)
+        monkeypatch.setattr('builtins.input', lambda: pytest.fail("input() called"))
+        assert yes_no_prompt("Continue?", True) is True
+        assert yes_no_prompt("Reinstall?", False) is False
+
+
+class TestPresetChoice:
+    """Test cases for choices given with set_prompt_mode."""
+
+    @pytest.fixture(autouse=True)
+    def prompt_mode(self):
+        yield
+        set_prompt_mode()
+
+    def test_preset(self):
+        """Test that a given choice is returned and other choices are not set."""
+        set_prompt_mode(accept_defaults=True, choices={'nvidia-driver': 'nvidia-driver-580'})
+        assert preset_choice('nvidia-driver') == 'nvidia-driver-580'
+        assert preset_choice('cuda-package') is None
+
+    def test_reset(self):
+        """Test that setting the prompt mode again drops earlier choices."""
+        set_prompt_mode(choices={'cuda-package': 'cuda-toolkit-13'})
+        set_prompt_mode()
+        assert preset_choice('cuda-package') is None
+
+
+class TestFlushBootUpdates:
+    """Test cases for schedule_boot_update and flush_boot_updates."""
+
+    @pytest.fixture(autouse=True)
+    def pending(self, monkeypatch):
+        monkeypatch.setattr(utils, '_pending_boot_updates', {})
+
+    def test_initramfs_runs_first(self, monkeypatch):
+        """Test that the initramfs is regenerated before grub, each once."""
+        ran = []
+
+        def fake_run(cmd, check):
+            ran.append(cmd[0])
+            return "", None, 0
+
+        monkeypatch.setattr(utils, 'run', fake_run)
+        schedule_boot_update('grub', ['update-grub'])
+        schedule_boot_update('initramfs', ['update-initramfs'])
+        schedule_boot_update('grub', ['update-grub'])
+
+        assert flush_boot_updates() is True
+        assert ran == ['update-initramfs', 'update-grub']
+        assert flush_boot_updates() is True
+        assert ran == ['update-initramfs', 'update-grub']
+
+    def test_missing_binary(self, tmp_path):
+        """Test that a missing tool is reported as a failure instead of raising."""
+        schedule_boot_update('initramfs', [str(tmp_path / 'missing')])
+
+        assert flush_boot_updates() is False
+
+    def test_no_reboot_after_failure(self, tmp_path, monkeypatch):
+        """Test that reboot_prompt does not reboot when the boot files could not be regenerated."""
+        monkeypatch.setattr(utils, '_accept_defaults', False)
+        monkeypatch.setattr(utils, '_skip_reboot', False)
+        monkeypatch.setattr('builtins.input', lambda: 'y')
+        monkeypatch.setattr(utils.os, 'execvp', lambda *args: pytest.fail("rebooted"))
+        schedule_boot_update('initramfs', [str(tmp_path / 'missing')])
+
+        with pytest.raises(RuntimeError):
+            reboot_prompt()
+
+
+class TestWhich:
+    """Test cases for the _which lookup cache."""
+
+    @pytest.fixture(autouse=True)
+    def cache(self, monkeypatch):
+        monkeypatch.setattr(utils, '_which_cache', {})
+
+    def test_missing_tool_is_not_cached(self, tmp_path, monkeypatch):
+        """Test that a tool installed after a failed lookup is found."""
+        monkeypatch.setenv('PATH', str(tmp_path))
+        assert utils._which('late-tool') is None
+
+        tool = tmp_path / 'late-tool'
+        tool.write_text('#!/bin/sh\n')
+        tool.chmod(0o755)
+        assert utils._which('late-tool') == str(tool)
+
+    def test_found_tool_is_cached(self, tmp_path, monkeypatch):
+        """Test that a found path is reused without searching PATH again."""
+        tool = tmp_path / 'tool'
+        tool.write_text('#!/bin/sh\n')
+        tool.chmod(0o755)
+        monkeypatch.setenv('PATH', str(tmp_path))
+        assert utils._which('tool') == str(tool)
+
+        monkeypatch.setenv('PATH', '')
+        assert utils._which('tool') == str(tool)